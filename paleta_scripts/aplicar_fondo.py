@@ -1,19 +1,24 @@
 import os
 import argparse
-from PIL import Image
+from collections import OrderedDict
+from duplicados import Deduplicador, encadenar_filtros
+from escritura import COMPRESION_PREDETERMINADA, Progreso, escribir_imagenes, guardar_imagen
+from incremental import Manifiesto, calcular_clave, huella_archivo
+from nucleo import EXTENSIONES_IMAGEN, cargar_imagen, detectar_sprites_por_numero, iterar_recortes, limites_por_numero
+from nucleo import agregar_opciones_comunes, perfil_de_ejecucion, validar_opciones_comunes
+from paleta import Paleta
+from perezoso import importar_perezoso
+from piramide import construir_piramide, directorio_escala, escalar_cajas
+import perfil
 
-def cargar_imagen(ruta_imagen):
-    """Carga una imagen desde una ruta especificada."""
-    try:
-        imagen = Image.open(ruta_imagen)
-        return imagen
-    except Exception as e:
-        print(f"Error al cargar la imagen: {e}")
-        return None
+# NumPy, PIL y el atlas solo se importan al usarlos, para que --help arranque rápido
+Image = importar_perezoso("PIL.Image")
+np = importar_perezoso("numpy")
+atlas = importar_perezoso("atlas")
 
-def aplicar_fondo(imagen_frente, imagen_fondo, modo_ajuste="estirar"):
+def ajustar_fondo(imagen_fondo, tamaño, modo_ajuste="estirar"):
     """
-    Aplica una imagen de fondo a una imagen con transparencia.
+    Prepara la imagen de fondo para un tamaño de destino según el modo de ajuste.
     
     Modos de ajuste:
     - estirar: Estira el fondo para que coincida con las dimensiones de la imagen frontal
@@ -21,11 +26,7 @@ def aplicar_fondo(imagen_frente, imagen_fondo, modo_ajuste="estirar"):
     - mosaico: Repite el fondo en mosaico para cubrir toda la imagen
     - escalar: Escala el fondo proporcionalmente para cubrir la imagen
     """
-    # Asegurarse de que la imagen frontal tiene canal alpha
-    if imagen_frente.mode != 'RGBA':
-        imagen_frente = imagen_frente.convert('RGBA')
-    
-    ancho_frente, alto_frente = imagen_frente.size
+    ancho_frente, alto_frente = tamaño
     
     # Preparar el fondo según el modo de ajuste
     if modo_ajuste == "estirar":
@@ -44,13 +45,13 @@ def aplicar_fondo(imagen_frente, imagen_fondo, modo_ajuste="estirar"):
         fondo_ajustado.paste(imagen_fondo, (max(0, x), max(0, y)))
     
     elif modo_ajuste == "mosaico":
-        fondo_ajustado = Image.new('RGBA', (ancho_frente, alto_frente), (0, 0, 0, 0))
         ancho_fondo, alto_fondo = imagen_fondo.size
         
-        # Repetir el fondo en mosaico
-        for y in range(0, alto_frente, alto_fondo):
-            for x in range(0, ancho_frente, ancho_fondo):
-                fondo_ajustado.paste(imagen_fondo, (x, y))
+        # Repetir el fondo en mosaico y recortar lo que sobresale
+        datos_fondo = np.asarray(imagen_fondo.convert('RGBA'))
+        repeticiones = (-(-alto_frente // alto_fondo), -(-ancho_frente // ancho_fondo), 1)
+        mosaico = np.tile(datos_fondo, repeticiones)[:alto_frente, :ancho_frente]
+        fondo_ajustado = Image.fromarray(np.ascontiguousarray(mosaico))
     
     elif modo_ajuste == "escalar":
         ancho_fondo, alto_fondo = imagen_fondo.size
@@ -79,6 +80,97 @@ def aplicar_fondo(imagen_frente, imagen_fondo, modo_ajuste="estirar"):
         
         fondo_ajustado = fondo_redimensionado.crop((left, top, right, bottom))
     
+    return fondo_ajustado
+
+class CacheFondos:
+    """
+    Caché LRU de fondos ya ajustados.
+    
+    Todos los sprites de una hoja tienen el mismo tamaño, así que el fondo solo
+    necesita ajustarse una vez por combinación de (tamaño, modo de ajuste, fondo).
+    """
+    
+    def __init__(self, capacidad=32):
+        self.capacidad = capacidad
+        self.entradas = OrderedDict()
+        self.aciertos = 0
+        self.fallos = 0
+    
+    def obtener(self, imagen_fondo, tamaño, modo_ajuste="estirar"):
+        """Devuelve el fondo ajustado, calculándolo solo si no está en la caché."""
+        # La entrada guarda una referencia al fondo, así que su id no puede reutilizarse
+        # mientras siga en la caché
+        clave = (tuple(tamaño), modo_ajuste, id(imagen_fondo))
+        entrada = self.entradas.get(clave)
+        if entrada is not None and entrada[0] is imagen_fondo:
+            self.entradas.move_to_end(clave)
+            self.aciertos += 1
+            return entrada[1]
+        
+        self.fallos += 1
+        fondo_ajustado = ajustar_fondo(imagen_fondo, tamaño, modo_ajuste)
+        self.entradas[clave] = (imagen_fondo, fondo_ajustado)
+        self.entradas.move_to_end(clave)
+        while len(self.entradas) > self.capacidad:
+            self.entradas.popitem(last=False)
+        return fondo_ajustado
+    
+    def limpiar(self):
+        """Vacía la caché y reinicia los contadores."""
+        self.entradas.clear()
+        self.aciertos = 0
+        self.fallos = 0
+
+# Caché compartida por todas las llamadas a aplicar_fondo
+cache_fondos = CacheFondos()
+
+# Fondos ya decodificados, por ruta, fecha y tamaño del archivo
+fondos_cargados = OrderedDict()
+MAX_FONDOS_CARGADOS = 8
+
+def cargar_fondo(ruta_fondo):
+    """
+    Carga y decodifica una imagen de fondo, reutilizándola mientras el archivo no cambie.
+    
+    En una sola ejecución el fondo se carga una vez de todos modos, pero en el
+    servidor (ver servidor.py) se conserva de un trabajo al siguiente, y con él
+    los fondos ya ajustados de `cache_fondos`.
+    """
+    try:
+        estado = os.stat(ruta_fondo)
+    except OSError as e:
+        print(f"Error al cargar la imagen: {e}")
+        return None
+    clave = (os.path.abspath(ruta_fondo), estado.st_mtime_ns, estado.st_size)
+    if clave in fondos_cargados:
+        fondos_cargados.move_to_end(clave)
+        return fondos_cargados[clave]
+    
+    imagen_fondo = cargar_imagen(ruta_fondo)
+    if imagen_fondo:
+        imagen_fondo.load()
+        fondos_cargados[clave] = imagen_fondo
+        while len(fondos_cargados) > MAX_FONDOS_CARGADOS:
+            fondos_cargados.popitem(last=False)
+    return imagen_fondo
+
+def aplicar_fondo(imagen_frente, imagen_fondo, modo_ajuste="estirar", cache=None):
+    """
+    Aplica una imagen de fondo a una imagen con transparencia.
+    
+    El fondo ajustado se reutiliza desde `cache` (por defecto, la caché del
+    módulo). Los modos de ajuste se describen en `ajustar_fondo`.
+    """
+    # Asegurarse de que la imagen frontal tiene canal alpha
+    if imagen_frente.mode != 'RGBA':
+        imagen_frente = imagen_frente.convert('RGBA')
+    
+    ancho_frente, alto_frente = imagen_frente.size
+    
+    if cache is None:
+        cache = cache_fondos
+    fondo_ajustado = cache.obtener(imagen_fondo, (ancho_frente, alto_frente), modo_ajuste)
+    
     # Combinar las imágenes
     resultado = Image.new('RGBA', (ancho_frente, alto_frente), (0, 0, 0, 0))
     resultado.paste(fondo_ajustado, (0, 0))
@@ -86,6 +178,136 @@ def aplicar_fondo(imagen_frente, imagen_fondo, modo_ajuste="estirar"):
     
     return resultado
 
+def componer_lote(frentes, fondo):
+    """
+    Aplica un mismo fondo a un lote de sprites del mismo tamaño en una sola operación.
+    
+    `frentes` es un array N×H×W×4 y `fondo` un array H×W×4, ambos RGBA en uint8.
+    La mezcla reproduce exactamente el pegado con máscara de PIL que usa
+    `aplicar_fondo`, así que el resultado es idéntico bit a bit.
+    """
+    mascara = frentes[..., 3:4].astype(np.uint16)
+    # Misma aritmética entera que PIL: (fondo*(255-a) + frente*a) / 255 redondeado
+    mezcla = fondo.astype(np.uint16) * (255 - mascara) + frentes.astype(np.uint16) * mascara + 128
+    mezcla = ((mezcla >> 8) + mezcla) >> 8
+    return mezcla.astype(np.uint8)
+
+def iterar_filas_cuadricula(imagen, num_horizontal, num_vertical):
+    """
+    Recorre una hoja en cuadrícula fila a fila.
+    
+    Cada fila se devuelve como un array num_horizontal×H×W×4, en el mismo orden
+    que `detectar_sprites_por_numero`. Solo se copia a NumPy una fila de la
+    hoja cada vez, así que la memoria no crece con el número de filas.
+    """
+    alto_sprite = imagen.height // num_vertical
+    ancho_sprite = imagen.width // num_horizontal
+    for y in range(num_vertical):
+        fila = imagen.crop((0, y * alto_sprite, ancho_sprite * num_horizontal, (y + 1) * alto_sprite))
+        if fila.mode != 'RGBA':
+            fila = fila.convert('RGBA')
+        datos = np.asarray(fila)
+        yield datos.reshape(alto_sprite, num_horizontal, ancho_sprite, 4).transpose(1, 0, 2, 3)
+
+def iterar_sprites_compuestos(imagen_frente, imagen_fondo, modo_ajuste, num_horizontal, num_vertical,
+                              motor="numpy", cache=None):
+    """
+    Divide una hoja en cuadrícula y genera cada sprite con el fondo aplicado.
+    
+    Con el motor 'numpy' cada fila de la cuadrícula se compone de una vez con
+    `componer_lote`; con 'pil' se usa `aplicar_fondo` sprite a sprite. En ambos
+    casos los sprites se generan bajo demanda, así que nunca hay más de una
+    fila compuesta en memoria.
+    """
+    # Sin píxeles que componer (más divisiones que píxeles) se mantiene el camino de PIL
+    vacia = imagen_frente.width < num_horizontal or imagen_frente.height < num_vertical
+    if motor == "pil" or vacia:
+        for limite in limites_por_numero(imagen_frente.size, num_horizontal, num_vertical):
+            yield aplicar_fondo(imagen_frente.crop(limite), imagen_fondo, modo_ajuste, cache)
+        return
+    
+    if cache is None:
+        cache = cache_fondos
+    tamaño_sprite = (imagen_frente.width // num_horizontal, imagen_frente.height // num_vertical)
+    fondo_ajustado = cache.obtener(imagen_fondo, tamaño_sprite, modo_ajuste)
+    fondo = np.asarray(fondo_ajustado.convert('RGBA'))
+    for frentes in iterar_filas_cuadricula(imagen_frente, num_horizontal, num_vertical):
+        for resultado in componer_lote(frentes, fondo):
+            yield Image.fromarray(resultado)
+
+def componer_sprites(imagen_frente, imagen_fondo, modo_ajuste, num_horizontal, num_vertical,
+                     motor="numpy", cache=None):
+    """Divide una hoja en cuadrícula y devuelve la lista de sprites con el fondo aplicado."""
+    return list(iterar_sprites_compuestos(imagen_frente, imagen_fondo, modo_ajuste,
+                                          num_horizontal, num_vertical, motor, cache))
+
+class AplicadorFondo:
+    """
+    Aplica un fondo a los recortes que produce otra herramienta, como `dividir.procesar_hoja`.
+    
+    Se llama con un iterable de recortes y genera los mismos recortes con el
+    fondo aplicado, sin pasar por disco. Con el motor 'numpy', los recortes
+    consecutivos del mismo tamaño se componen en lotes de hasta `lote` con
+    `componer_lote`. El fondo se carga la primera vez que se usa, también en
+    cada proceso de un lote, y `rutas_entrada` indica al modo incremental qué
+    archivos, además de la hoja, influyen en el resultado.
+    """
+    
+    def __init__(self, ruta_fondo, modo_ajuste="estirar", motor="numpy", lote=16):
+        self.ruta_fondo = ruta_fondo
+        self.modo_ajuste = modo_ajuste
+        self.motor = motor
+        self.lote = max(1, lote)
+        self.rutas_entrada = [ruta_fondo]
+        self.imagen_fondo = None
+    
+    def __getstate__(self):
+        # El fondo no se envía a los procesos del lote: cada uno lo carga de nuevo
+        return {**self.__dict__, "imagen_fondo": None}
+    
+    def cargar(self):
+        """Carga y decodifica el fondo si aún no lo está. Devuelve la imagen o None."""
+        if self.imagen_fondo is None:
+            with perfil.etapa("carga", imagen=self.ruta_fondo):
+                self.imagen_fondo = cargar_fondo(self.ruta_fondo)
+        return self.imagen_fondo
+    
+    def __call__(self, recortes):
+        return componer_recortes(recortes, self.cargar(), self.modo_ajuste, self.motor, self.lote)
+
+def componer_recortes(recortes, imagen_fondo, modo_ajuste="estirar", motor="numpy", lote=16):
+    """
+    Aplica el fondo a cada recorte de un iterable, que pueden tener tamaños distintos.
+    
+    Con el motor 'numpy', los recortes consecutivos del mismo tamaño se
+    componen en lotes de hasta `lote` con `componer_lote`.
+    """
+    if motor == "pil":
+        for recorte in recortes:
+            yield aplicar_fondo(recorte, imagen_fondo, modo_ajuste)
+        return
+    
+    grupo = []
+    for recorte in recortes:
+        if grupo and (recorte.size != grupo[0].size or len(grupo) == lote):
+            yield from componer_grupo(grupo, imagen_fondo, modo_ajuste)
+            grupo = []
+        grupo.append(recorte)
+    if grupo:
+        yield from componer_grupo(grupo, imagen_fondo, modo_ajuste)
+
+def componer_grupo(grupo, imagen_fondo, modo_ajuste="estirar"):
+    """Compone de una vez un grupo de recortes del mismo tamaño."""
+    ancho, alto = grupo[0].size
+    if ancho == 0 or alto == 0:
+        for recorte in grupo:
+            yield aplicar_fondo(recorte, imagen_fondo, modo_ajuste)
+        return
+    fondo = np.asarray(cache_fondos.obtener(imagen_fondo, (ancho, alto), modo_ajuste).convert('RGBA'))
+    frentes = np.stack([np.asarray(recorte.convert('RGBA')) for recorte in grupo])
+    for resultado in componer_lote(frentes, fondo):
+        yield Image.fromarray(resultado)
+
 def recortar_imagen(imagen, ancho, alto, modo_recorte="centro"):
     """
     Recorta una imagen al tamaño especificado.
@@ -115,33 +337,138 @@ def recortar_imagen(imagen, ancho, alto, modo_recorte="centro"):
         
         return imagen.crop((left, top, right, bottom))
 
-def detectar_sprites_por_numero(imagen, num_horizontal, num_vertical):
-    """Detecta los límites de cada sprite en una imagen basado en el número de sprites horizontal y verticalmente."""
-    imagen_ancho, imagen_alto = imagen.size
-    ancho_sprite = imagen_ancho // num_horizontal
-    alto_sprite = imagen_alto // num_vertical
+def guardar_sprites_compuestos(resultados, directorio_salida, nombre_base, en_vuelo=8,
+                               hilos=None, compresion=COMPRESION_PREDETERMINADA, optimizar=False, filtro=None):
+    """
+    Guarda los sprites con fondo a medida que se generan.
     
-    sprites = []
-    limites = []
+    Como mucho quedan `en_vuelo` sprites compuestos pendientes de escribir, y la
+    codificación PNG se reparte entre `hilos` hilos. Con `filtro` solo se
+    escriben los sprites que han cambiado.
+    """
+    elementos = ((os.path.join(directorio_salida, f"{nombre_base}_{i+1}.png"), resultado)
+                 for i, resultado in enumerate(resultados))
+    if filtro:
+        elementos = filtro(elementos)
+    progreso = Progreso("Sprites procesados")
+    total = escribir_imagenes(elementos, compresion, optimizar, hilos, en_vuelo, progreso)
+    progreso.terminar(directorio_salida)
+    return total
+
+def procesar_archivo(ruta_frente, imagen_fondo, directorio_salida, prefijo="fondo_", modo_ajuste="estirar",
+                     num_horizontal=0, num_vertical=0, motor="numpy", en_vuelo=8, hilos=None,
+                     compresion=COMPRESION_PREDETERMINADA, optimizar=False, formato="png",
+                     manifiesto=None, parametros=None, deduplicar=False, paleta=False, escalas=None):
+    """
+    Aplica el fondo a una imagen, o a cada sprite de su cuadrícula, y guarda el resultado.
     
-    for y in range(num_vertical):
-        for x in range(num_horizontal):
-            left = x * ancho_sprite
-            upper = y * alto_sprite
-            right = left + ancho_sprite
-            lower = upper + alto_sprite
-            
-            sprite = imagen.crop((left, upper, right, lower))
-            sprites.append(sprite)
-            limites.append((left, upper, right, lower))
-    
-    return sprites, limites
+    Con `manifiesto`, la imagen se omite si ni ella ni los `parametros` (que
+    incluyen la huella del fondo) han cambiado, y si no, solo se reescriben los
+    archivos distintos. Con `deduplicar`, los sprites idénticos de la cuadrícula
+    se guardan una sola vez. Con `paleta`, se guardan PNG indexados con una
+    paleta común a toda la hoja. Con `escalas`, la imagen se decodifica una vez
+    y cada escala se guarda en un subdirectorio (ver `piramide.construir_piramide`).
+    """
+    archivo = os.path.basename(ruta_frente)
+    if manifiesto:
+        clave = calcular_clave([ruta_frente], parametros)
+        if manifiesto.sin_cambios(ruta_frente, clave):
+            print(f"Sin cambios: {ruta_frente}")
+            return
+        manifiesto.iniciar_hoja(ruta_frente, [compresion, optimizar, paleta])
+    filtro = manifiesto.filtro(ruta_frente) if manifiesto else None
+    
+    with perfil.etapa("carga", imagen=ruta_frente):
+        imagen_frente = cargar_imagen(ruta_frente)
+        if imagen_frente:
+            # Decodificar aquí para que el coste no se atribuya a la composición
+            imagen_frente.load()
+    
+    if not imagen_frente:
+        return
+    
+    if escalas:
+        niveles = perfil.medir_iterable("piramide", construir_piramide(imagen_frente, escalas), imagen=ruta_frente)
+    else:
+        niveles = [(1, imagen_frente)]
+    for escala, nivel in niveles:
+        directorio = directorio_escala(directorio_salida, escala) if escalas else directorio_salida
+        os.makedirs(directorio, exist_ok=True)
+        # Los colores con el fondo aplicado no se conocen de antemano, así que la
+        # paleta de la hoja crece con cada sprite compuesto
+        paleta_hoja = Paleta() if paleta else None
+        
+        # Detectar sprites por número si se especificaron
+        if num_horizontal > 0 and num_vertical > 0:
+            limites = limites_por_numero(imagen_frente.size, num_horizontal, num_vertical)
+            if nivel is imagen_frente:
+                resultados = iterar_sprites_compuestos(imagen_frente, imagen_fondo, modo_ajuste, num_horizontal,
+                                                       num_vertical, motor)
+            else:
+                # La cuadrícula se calcula a resolución completa y se lleva a este nivel
+                limites = escalar_cajas(limites, imagen_frente.size, nivel.size)
+                resultados = componer_recortes(iterar_recortes(nivel, limites), imagen_fondo, modo_ajuste, motor)
+            resultados = perfil.medir_iterable("composicion", resultados, imagen=ruta_frente)
+            nombre_base = f"{prefijo}{archivo.split('.')[0]}"
+            with perfil.etapa("escritura", imagen=ruta_frente):
+                if formato == "png":
+                    deduplicador = Deduplicador() if deduplicar else None
+                    guardar_sprites_compuestos(resultados, directorio, nombre_base, en_vuelo, hilos, compresion,
+                                               optimizar, encadenar_filtros(deduplicador, filtro, paleta_hoja))
+                    if deduplicador:
+                        ruta_indice = deduplicador.guardar_indice(directorio, nombre_base, limites)
+                        if manifiesto:
+                            manifiesto.anotar(ruta_frente, ruta_indice)
+                        print(f"Sprites únicos: {deduplicador.unicos} de {len(limites)} (índice en {ruta_indice})")
+                else:
+                    atlas.guardar_sprites_atlas(resultados, limites, directorio, nombre_base, formato,
+                                                compresion, optimizar)
+                    if manifiesto:
+                        for ruta_salida in atlas.rutas_atlas(os.path.join(directorio, nombre_base), formato):
+                            manifiesto.anotar(ruta_frente, ruta_salida)
+        else:
+            # Aplicar fondo a la imagen completa
+            with perfil.etapa("composicion", imagen=ruta_frente):
+                resultado = aplicar_fondo(nivel, imagen_fondo, modo_ajuste)
+            ruta_salida = os.path.join(directorio, f"{prefijo}{archivo}")
+            with perfil.etapa("escritura", imagen=ruta_frente):
+                pendientes = [(ruta_salida, resultado)]
+                filtros = encadenar_filtros(filtro, paleta_hoja)
+                if filtros:
+                    pendientes = filtros(pendientes)
+                for ruta_salida, resultado in pendientes:
+                    guardar_imagen(resultado, ruta_salida, compresion, optimizar)
+            print(f"Imagen procesada: {ruta_salida}")
+        
+        if paleta_hoja:
+            print(paleta_hoja.resumen())
+    
+    if manifiesto:
+        sin_cambios, eliminados = manifiesto.cerrar_hoja(ruta_frente, clave)
+        manifiesto.guardar()
+        print(f"Incremental: {sin_cambios} archivos sin cambios, {eliminados} archivos antiguos eliminados")
 
 def procesar_imagenes(ruta_frente, ruta_fondo, directorio_salida, prefijo="fondo_", 
-                      modo_ajuste="estirar", num_horizontal=0, num_vertical=0):
-    """Procesa una o más imágenes aplicándoles un fondo común y detectando el número de sprites."""
+                      modo_ajuste="estirar", num_horizontal=0, num_vertical=0, motor="numpy",
+                      en_vuelo=8, hilos=None, compresion=COMPRESION_PREDETERMINADA, optimizar=False,
+                      formato="png", incremental=False, deduplicar=False, paleta=False, escalas=None):
+    """
+    Procesa una o más imágenes aplicándoles un fondo común y detectando el número de sprites.
+    
+    Con `formato` 'atlas' o 'bruto', los sprites de cada hoja en cuadrícula se
+    guardan en un único archivo con índice (ver `atlas.guardar_atlas`). Con
+    `incremental`, se omiten las imágenes que no han cambiado desde la última
+    ejecución según el manifiesto del directorio de salida. Con `deduplicar`,
+    los sprites idénticos se guardan una sola vez junto a un índice JSON, y con
+    `paleta` se guardan como PNG indexados (ver `paleta.Paleta`). Con `escalas`,
+    cada imagen se guarda también reducida, en un subdirectorio por escala.
+    """
+    # La caché sobrevive entre trabajos del servidor, así que se informa solo de este
+    aciertos_previos, fallos_previos = cache_fondos.aciertos, cache_fondos.fallos
+    
     # Cargar la imagen de fondo
-    imagen_fondo = cargar_imagen(ruta_fondo)
+    with perfil.etapa("carga", imagen=ruta_fondo):
+        imagen_fondo = cargar_fondo(ruta_fondo)
     if not imagen_fondo:
         return
     
@@ -151,62 +478,38 @@ def procesar_imagenes(ruta_frente, ruta_fondo, directorio_salida, prefijo="fondo
     # Determinar si la ruta_frente es un directorio o un archivo
     if os.path.isdir(ruta_frente):
         # Procesar todas las imágenes en el directorio
-        archivos = [f for f in os.listdir(ruta_frente) if f.lower().endswith(('.png', '.jpg', '.jpeg', '.gif'))]
+        archivos = [f for f in os.listdir(ruta_frente) if f.lower().endswith(EXTENSIONES_IMAGEN)]
         
         if not archivos:
             print(f"No se encontraron imágenes en el directorio: {ruta_frente}")
             return
         
-        for archivo in archivos:
-            ruta_completa = os.path.join(ruta_frente, archivo)
-            imagen_frente = cargar_imagen(ruta_completa)
-            
-            if imagen_frente:
-                # Detectar sprites por número si se especificaron
-                if num_horizontal > 0 and num_vertical > 0:
-                    sprites, limites = detectar_sprites_por_numero(imagen_frente, num_horizontal, num_vertical)
-                    for i, sprite in enumerate(sprites):
-                        # Aplicar fondo a cada sprite
-                        resultado = aplicar_fondo(sprite, imagen_fondo, modo_ajuste)
-                        nombre_salida = f"{prefijo}{archivo.split('.')[0]}_{i+1}.png"
-                        ruta_salida = os.path.join(directorio_salida, nombre_salida)
-                        resultado.save(ruta_salida)
-                        print(f"Sprite procesado: {ruta_salida}")
-                else:
-                    # Aplicar fondo a la imagen completa
-                    resultado = aplicar_fondo(imagen_frente, imagen_fondo, modo_ajuste)
-                    nombre_salida = f"{prefijo}{archivo}"
-                    ruta_salida = os.path.join(directorio_salida, nombre_salida)
-                    resultado.save(ruta_salida)
-                    print(f"Imagen procesada: {ruta_salida}")
-    
+        rutas = [os.path.join(ruta_frente, archivo) for archivo in archivos]
     else:
         # Procesar un solo archivo
-        imagen_frente = cargar_imagen(ruta_frente)
-        
-        if imagen_frente:
-            # Detectar sprites por número si se especificaron
-            if num_horizontal > 0 and num_vertical > 0:
-                sprites, limites = detectar_sprites_por_numero(imagen_frente, num_horizontal, num_vertical)
-                for i, sprite in enumerate(sprites):
-                    # Aplicar fondo a cada sprite
-                    resultado = aplicar_fondo(sprite, imagen_fondo, modo_ajuste)
-                    nombre_base = os.path.basename(ruta_frente).split('.')[0]
-                    nombre_salida = f"{prefijo}{nombre_base}_{i+1}.png"
-                    ruta_salida = os.path.join(directorio_salida, nombre_salida)
-                    resultado.save(ruta_salida)
-                    print(f"Sprite procesado: {ruta_salida}")
-            else:
-                # Aplicar fondo a la imagen completa
-                resultado = aplicar_fondo(imagen_frente, imagen_fondo, modo_ajuste)
-                nombre_base = os.path.basename(ruta_frente)
-                nombre_salida = f"{prefijo}{nombre_base}"
-                ruta_salida = os.path.join(directorio_salida, nombre_salida)
-                
-                resultado.save(ruta_salida)
-                print(f"Imagen procesada: {ruta_salida}")
-
-def main():
+        rutas = [ruta_frente]
+    
+    manifiesto = parametros = None
+    if incremental:
+        manifiesto = Manifiesto(directorio_salida)
+        # El motor no cambia los píxeles, así que no forma parte de la clave
+        parametros = {"fondo": huella_archivo(ruta_fondo), "prefijo": prefijo, "modo_ajuste": modo_ajuste,
+                      "num_horizontal": num_horizontal, "num_vertical": num_vertical, "compresion": compresion,
+                      "optimizar": optimizar, "formato": formato, "deduplicar": deduplicar, "paleta": paleta,
+                      "escalas": escalas}
+    
+    for ruta in rutas:
+        procesar_archivo(ruta, imagen_fondo, directorio_salida, prefijo, modo_ajuste, num_horizontal,
+                         num_vertical, motor, en_vuelo, hilos, compresion, optimizar, formato,
+                         manifiesto, parametros, deduplicar, paleta, escalas)
+    
+    aciertos = cache_fondos.aciertos - aciertos_previos
+    fallos = cache_fondos.fallos - fallos_previos
+    if aciertos or fallos:
+        print(f"Caché de fondos: {aciertos} aciertos, {fallos} fallos.")
+
+def crear_parser():
+    """Crea el parser de argumentos de la línea de comandos."""
     parser = argparse.ArgumentParser(description="Aplica un fondo a imágenes con transparencia y luego las recorta.")
     parser.add_argument("frente", help="Ruta de la imagen o directorio con imágenes frontales")
     parser.add_argument("fondo", help="Ruta de la imagen de fondo a aplicar")
@@ -220,19 +523,62 @@ def main():
                         help="Número de sprites horizontalmente (para detectar sprites por número)")
     parser.add_argument("--num_vertical", type=int, default=0,
                         help="Número de sprites verticalmente (para detectar sprites por número)")
+    parser.add_argument("--motor", choices=["numpy", "pil"], default="numpy",
+                        help="Motor de composición de los sprites en cuadrícula (predeterminado: 'numpy')")
+    agregar_opciones_comunes(
+        parser, "carga, composición, codificación, escritura",
+        formato="Salida de los sprites en cuadrícula: un PNG por sprite, un atlas PNG empaquetado "
+                "o un bloque RGBA bruto, ambos con un índice binario (predeterminado: 'png'; "
+                "atlas y bruto solo con --num_horizontal y --num_vertical)",
+        paleta="Guarda PNG indexados con una paleta común a cada hoja; los sprites que ya no caben "
+               "en 256 colores se guardan en RGBA (solo con --formato png)",
+        deduplicar="Guarda una sola vez los sprites de la cuadrícula con píxeles idénticos y escribe "
+                   "'<prefijo><imagen>_indice.json' con el archivo de cada celda (solo con --formato png y "
+                   "--num_horizontal y --num_vertical)")
+    return parser
+
+def validar_argumentos(args):
+    """
+    Comprueba las combinaciones de argumentos. Devuelve un mensaje de error o None.
+
+    El formato de salida y la deduplicación solo se aplican a los sprites en
+    cuadrícula; las imágenes completas siempre se guardan como un PNG cada una.
+    """
+    en_cuadricula = args.num_horizontal > 0 and args.num_vertical > 0
+    if args.formato != "png" and not en_cuadricula:
+        return "Error: --formato atlas o bruto solo puede usarse con --num_horizontal y --num_vertical."
+    if args.deduplicar and not en_cuadricula:
+        return "Error: --deduplicar solo puede usarse con --num_horizontal y --num_vertical."
+    return validar_opciones_comunes(args)
+
+def main(argumentos=None):
+    args = crear_parser().parse_args(argumentos)
+    error = validar_argumentos(args)
+    if error:
+        print(error)
+        return
     
-    args = parser.parse_args()
-    
-    procesar_imagenes(
-        args.frente, 
-        args.fondo, 
-        args.salida, 
-        args.prefijo, 
-        args.modo,
-        args.num_horizontal,
-        args.num_vertical
-    )
-    print("Proceso completado con éxito.")
+    with perfil_de_ejecucion(args):
+        procesar_imagenes(
+            args.frente, 
+            args.fondo, 
+            args.salida, 
+            args.prefijo, 
+            args.modo,
+            args.num_horizontal,
+            args.num_vertical,
+            args.motor,
+            args.en_vuelo,
+            args.hilos,
+            args.compresion,
+            args.optimizar,
+            args.formato,
+            args.incremental,
+            args.deduplicar,
+            args.paleta,
+            args.escalas
+        )
+        print("Proceso completado con éxito.")
 
 if __name__ == "__main__":
     main()
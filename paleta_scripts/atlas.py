@@ -0,0 +1,189 @@
+import os
+import math
+import struct
+from escritura import COMPRESION_PREDETERMINADA, guardar_imagen
+from perezoso import importar_perezoso
+
+Image = importar_perezoso("PIL.Image")
+np = importar_perezoso("numpy")
+
+# Cabecera del índice: firma, versión, tipo de datos, número de sprites y bytes de la tabla de nombres
+MAGIA = b"PALA"
+VERSION = 1
+CABECERA = struct.Struct("<4sHHII")
+
+TIPO_BRUTO = 0
+TIPO_ATLAS = 1
+EXTENSIONES = {TIPO_BRUTO: ".rgba", TIPO_ATLAS: ".png"}
+FORMATOS = {"bruto": TIPO_BRUTO, "atlas": TIPO_ATLAS}
+
+# Una entrada de tamaño fijo por sprite: límites en la hoja original, tamaño,
+# posición en el atlas (o desplazamiento en bytes en el bloque bruto) y nombre
+ENTRADA = np.dtype([
+    ("x1", "<i4"), ("y1", "<i4"), ("x2", "<i4"), ("y2", "<i4"),
+    ("ancho", "<u4"), ("alto", "<u4"),
+    ("atlas_x", "<u4"), ("atlas_y", "<u4"),
+    ("desplazamiento", "<u8"),
+    ("nombre_inicio", "<u4"), ("nombre_largo", "<u2"),
+])
+
+def empaquetar_estanterias(tamaños):
+    """
+    Coloca rectángulos (ancho, alto) en filas, de más alto a más bajo.
+
+    Devuelve la posición (x, y) de cada rectángulo, en el orden de entrada, y el
+    tamaño (ancho, alto) del atlas resultante, que queda aproximadamente cuadrado.
+    """
+    if not tamaños:
+        return [], (0, 0)
+
+    area = sum(ancho * alto for ancho, alto in tamaños)
+    ancho_atlas = max(max(ancho for ancho, _ in tamaños), math.ceil(math.sqrt(area)))
+
+    posiciones = [None] * len(tamaños)
+    x = y = alto_fila = 0
+    for i in sorted(range(len(tamaños)), key=lambda i: -tamaños[i][1]):
+        ancho, alto = tamaños[i]
+        if x + ancho > ancho_atlas:
+            # Nueva fila por debajo de la más alta de la actual
+            y += alto_fila
+            x = alto_fila = 0
+        posiciones[i] = (x, y)
+        x += ancho
+        alto_fila = max(alto_fila, alto)
+
+    return posiciones, (ancho_atlas, y + alto_fila)
+
+def rutas_atlas(ruta_base, formato):
+    """Devuelve las rutas del índice y de los datos de un atlas."""
+    return ruta_base + ".idx", ruta_base + EXTENSIONES[FORMATOS[formato]]
+
+def guardar_atlas(sprites, limites, ruta_base, nombres, formato="atlas",
+                  compresion=COMPRESION_PREDETERMINADA, optimizar=False):
+    """
+    Guarda todos los sprites en un único archivo de datos más un índice binario.
+
+    - atlas: los sprites se empaquetan en una sola imagen PNG
+    - bruto: los píxeles RGBA de cada sprite se escriben uno tras otro en un bloque
+      que después puede abrirse con memoria mapeada
+
+    `limites` son las cajas (x1, y1, x2, y2) de cada sprite en la hoja, y se
+    conocen antes de recortar, así que `sprites` puede ser un generador: en modo
+    bruto cada sprite se escribe según llega. Devuelve el número de sprites.
+    """
+    tipo = FORMATOS[formato]
+    ruta_indice, ruta_datos = rutas_atlas(ruta_base, formato)
+
+    entradas = np.zeros(len(limites), dtype=ENTRADA)
+    if len(limites):
+        cajas = np.asarray(limites, dtype=np.int64).reshape(-1, 4)
+        entradas["x1"], entradas["y1"], entradas["x2"], entradas["y2"] = cajas.T
+        entradas["ancho"] = cajas[:, 2] - cajas[:, 0]
+        entradas["alto"] = cajas[:, 3] - cajas[:, 1]
+
+    nombres_codificados = [nombre.encode("utf-8") for nombre in nombres]
+    largos = np.array([len(nombre) for nombre in nombres_codificados], dtype=np.int64)
+    entradas["nombre_largo"] = largos
+    entradas["nombre_inicio"] = np.cumsum(largos) - largos
+
+    total = 0
+    if tipo == TIPO_BRUTO:
+        tamaños_bytes = entradas["ancho"].astype(np.uint64) * entradas["alto"] * 4
+        entradas["desplazamiento"] = np.cumsum(tamaños_bytes) - tamaños_bytes
+        with open(ruta_datos, "wb") as datos:
+            for sprite in sprites:
+                datos.write(sprite.convert("RGBA").tobytes())
+                total += 1
+    else:
+        posiciones, (ancho_atlas, alto_atlas) = empaquetar_estanterias(
+            list(zip(entradas["ancho"].tolist(), entradas["alto"].tolist())))
+        if posiciones:
+            entradas["atlas_x"], entradas["atlas_y"] = np.asarray(posiciones).T
+        # PNG no admite imágenes vacías: sin sprites (o solo vacíos) se guarda
+        # un atlas transparente de 1×1 y el índice queda con 0 entradas
+        lienzo = np.zeros((max(1, alto_atlas), max(1, ancho_atlas), 4), dtype=np.uint8)
+        for entrada, sprite in zip(entradas, sprites):
+            x, y = int(entrada["atlas_x"]), int(entrada["atlas_y"])
+            lienzo[y:y + entrada["alto"], x:x + entrada["ancho"]] = np.asarray(sprite.convert("RGBA"))
+            total += 1
+        guardar_imagen(Image.fromarray(lienzo), ruta_datos, compresion, optimizar)
+
+    tabla_nombres = b"".join(nombres_codificados)
+    with open(ruta_indice, "wb") as indice:
+        indice.write(CABECERA.pack(MAGIA, VERSION, tipo, len(entradas), len(tabla_nombres)))
+        indice.write(entradas.tobytes())
+        indice.write(tabla_nombres)
+
+    return total
+
+class Atlas:
+    """
+    Lector de atlas guardados con `guardar_atlas`.
+
+    Los sprites se devuelven como vistas de NumPy H×W×4 sobre los datos, sin
+    copiarlos. En formato bruto los datos se abren con memoria mapeada, así que
+    solo se leen del disco los sprites que se usan.
+    """
+
+    def __init__(self, ruta_indice):
+        with open(ruta_indice, "rb") as indice:
+            magia, version, tipo, num_sprites, largo_nombres = CABECERA.unpack(indice.read(CABECERA.size))
+            if magia != MAGIA or version != VERSION:
+                raise ValueError(f"El archivo no es un índice de atlas válido: {ruta_indice}")
+            self.entradas = np.frombuffer(indice.read(num_sprites * ENTRADA.itemsize), dtype=ENTRADA)
+            tabla_nombres = indice.read(largo_nombres)
+
+        self.tipo = tipo
+        self.nombres = [
+            tabla_nombres[inicio:inicio + largo].decode("utf-8")
+            for inicio, largo in zip(self.entradas["nombre_inicio"].tolist(), self.entradas["nombre_largo"].tolist())
+        ]
+        self.indices = {nombre: i for i, nombre in enumerate(self.nombres)}
+
+        ruta_datos = os.path.splitext(ruta_indice)[0] + EXTENSIONES[tipo]
+        if tipo == TIPO_BRUTO:
+            if os.path.getsize(ruta_datos) == 0:
+                self.datos = np.zeros(0, dtype=np.uint8)
+            else:
+                self.datos = np.memmap(ruta_datos, dtype=np.uint8, mode="r")
+        else:
+            with Image.open(ruta_datos) as imagen:
+                self.datos = np.asarray(imagen.convert("RGBA"))
+
+    def __len__(self):
+        return len(self.entradas)
+
+    @property
+    def limites(self):
+        """Límites (x1, y1, x2, y2) de cada sprite en la hoja original."""
+        return [tuple(limite) for limite in self.entradas[["x1", "y1", "x2", "y2"]].tolist()]
+
+    def sprite(self, clave):
+        """Devuelve el sprite indicado por posición o por nombre como una vista H×W×4."""
+        i = self.indices[clave] if isinstance(clave, str) else clave
+        entrada = self.entradas[i]
+        ancho, alto = int(entrada["ancho"]), int(entrada["alto"])
+        if self.tipo == TIPO_BRUTO:
+            inicio = int(entrada["desplazamiento"])
+            return self.datos[inicio:inicio + ancho * alto * 4].reshape(alto, ancho, 4)
+        x, y = int(entrada["atlas_x"]), int(entrada["atlas_y"])
+        return self.datos[y:y + alto, x:x + ancho]
+
+    def imagen(self, clave):
+        """Devuelve el sprite indicado como una imagen RGBA de PIL (esto sí copia los píxeles)."""
+        return Image.fromarray(np.ascontiguousarray(self.sprite(clave)))
+
+def cargar_atlas(ruta_indice):
+    """Abre un atlas a partir de la ruta de su índice."""
+    return Atlas(ruta_indice)
+
+def guardar_sprites_atlas(sprites, limites, directorio_salida, nombre_base, formato="atlas",
+                          compresion=COMPRESION_PREDETERMINADA, optimizar=False, detallado=True):
+    """Guarda los sprites como '<nombre_base>.idx' más su atlas, con los nombres '<nombre_base>_N'."""
+    os.makedirs(directorio_salida, exist_ok=True)
+    ruta_base = os.path.join(directorio_salida, nombre_base)
+    nombres = [f"{nombre_base}_{i+1}" for i in range(len(limites))]
+    total = guardar_atlas(sprites, limites, ruta_base, nombres, formato, compresion, optimizar)
+    if detallado:
+        print(f"Atlas guardado: {rutas_atlas(ruta_base, formato)[0]} ({total} sprites)")
+    return total
@@ -0,0 +1,341 @@
+import os
+import io
+import sys
+import json
+import time
+import fnmatch
+import argparse
+import tempfile
+import multiprocessing
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+import numpy as np
+
+import dividir
+import aplicar_fondo
+import perfil
+
+# Hojas sintéticas: tamaño base en píxeles (antes de aplicar la escala) y forma de rellenarlas
+HOJAS = {
+    "cuadricula": {"ancho": 1024, "alto": 1024, "celda": 64},
+    "irregular": {"ancho": 2048, "alto": 2048, "sprites": 1500},
+    "disperso": {"ancho": 4096, "alto": 4096, "sprites": 40},
+    "enorme": {"ancho": 8192, "alto": 4096, "celda": 128},
+    "sin_alpha": {"ancho": 1024, "alto": 1024, "celda": 64},
+}
+
+def rectangulo_aleatorio(datos, rng, x, y, ancho_max, alto_max, margen=4):
+    """Pinta un rectángulo opaco de color aleatorio dentro de la caja indicada."""
+    ancho = int(rng.integers(1, max(2, ancho_max - 2 * margen)))
+    alto = int(rng.integers(1, max(2, alto_max - 2 * margen)))
+    x1 = x + margen + int(rng.integers(0, max(1, ancho_max - 2 * margen - ancho)))
+    y1 = y + margen + int(rng.integers(0, max(1, alto_max - 2 * margen - alto)))
+    datos[y1:y1 + alto, x1:x1 + ancho, :3] = rng.integers(0, 256, 3, dtype=np.uint8)
+    datos[y1:y1 + alto, x1:x1 + ancho, 3] = 255
+
+def generar_hoja(tipo, escala=1.0, semilla=0):
+    """
+    Genera una hoja de sprites sintética y reproducible.
+
+    - cuadricula / enorme: un sprite por celda, separados por huecos transparentes
+    - irregular: rectángulos de tamaños variados en posiciones aleatorias
+    - disperso: pocos sprites en una hoja casi vacía
+    - sin_alpha: como cuadricula, pero en RGB sin canal alpha
+    """
+    config = HOJAS[tipo]
+    rng = np.random.default_rng(semilla)
+    celda = config.get("celda")
+    # Con cuadrícula el tamaño se redondea a un número entero de celdas
+    ancho = max(1, int(config["ancho"] * escala))
+    alto = max(1, int(config["alto"] * escala))
+    if celda:
+        ancho, alto = max(celda, ancho // celda * celda), max(celda, alto // celda * celda)
+    datos = np.zeros((alto, ancho, 4), dtype=np.uint8)
+
+    if celda:
+        for y in range(0, alto, celda):
+            for x in range(0, ancho, celda):
+                rectangulo_aleatorio(datos, rng, x, y, celda, celda)
+    else:
+        num_sprites = max(1, int(config["sprites"] * escala * escala))
+        for _ in range(num_sprites):
+            lado_x, lado_y = (int(v) for v in rng.integers(8, 97, 2))
+            x = int(rng.integers(0, max(1, ancho - lado_x)))
+            y = int(rng.integers(0, max(1, alto - lado_y)))
+            rectangulo_aleatorio(datos, rng, x, y, lado_x, lado_y, margen=0)
+
+    imagen = Image.fromarray(datos)
+    if tipo == "sin_alpha":
+        imagen = imagen.convert("RGB")
+    return imagen
+
+def generar_fondo(semilla=0):
+    """Genera una textura de fondo RGB pequeña para aplicar_fondo."""
+    rng = np.random.default_rng(semilla)
+    return Image.fromarray(rng.integers(0, 256, (48, 48, 3), dtype=np.uint8))
+
+def definir_casos():
+    """Devuelve la lista de casos: nombre, hoja, script y opciones de cada uno."""
+    casos = []
+    modos_dividir = {
+        "cuadricula": ["fijo", "numero", "auto", "horizontal", "vertical", "componentes"],
+        "irregular": ["auto", "componentes"],
+        "disperso": ["auto", "componentes"],
+        "enorme": ["fijo", "componentes"],
+        "sin_alpha": ["fijo", "numero"],
+    }
+    for hoja, modos in modos_dividir.items():
+        for modo in modos:
+            casos.append({"nombre": f"dividir/{hoja}/{modo}", "hoja": hoja, "script": "dividir",
+                          "opciones": {"modo": modo}})
+
+    for modo in ["estirar", "centrar", "mosaico", "escalar"]:
+        casos.append({"nombre": f"aplicar_fondo/cuadricula/{modo}", "hoja": "cuadricula", "script": "aplicar_fondo",
+                      "opciones": {"modo_ajuste": modo, "motor": "numpy"}})
+    casos.append({"nombre": "aplicar_fondo/cuadricula/estirar_pil", "hoja": "cuadricula", "script": "aplicar_fondo",
+                  "opciones": {"modo_ajuste": "estirar", "motor": "pil"}})
+    for hoja in ["sin_alpha", "enorme"]:
+        casos.append({"nombre": f"aplicar_fondo/{hoja}/estirar", "hoja": hoja, "script": "aplicar_fondo",
+                      "opciones": {"modo_ajuste": "estirar", "motor": "numpy"}})
+    return casos
+
+def argumentos_dividir(ruta_hoja, directorio_salida, modo, celda, tamaño):
+    """Construye los argumentos de dividir.py para un caso, como si vinieran de la línea de comandos."""
+    args = dividir.crear_parser().parse_args([ruta_hoja, "--modo", modo, "--salida", directorio_salida])
+    args.ancho = args.alto = celda
+    args.num_horizontal = tamaño[0] // celda
+    args.num_vertical = tamaño[1] // celda
+    return args
+
+def medir(etapas, nombre, funcion, *argumentos):
+    """Ejecuta una función y añade su duración a `etapas`."""
+    inicio = time.perf_counter()
+    resultado = funcion(*argumentos)
+    etapas[nombre] = time.perf_counter() - inicio
+    return resultado
+
+def ejecutar_etapas(caso, ruta_hoja, ruta_fondo):
+    """
+    Ejecuta un caso etapa a etapa, cada una sobre el resultado completo de la anterior.
+
+    Devuelve los tiempos por etapa, el número de sprites y los megapíxeles de la
+    hoja. Esta ejecución guarda todos los recortes en memoria, así que no sirve
+    para medir la memoria del caso (ver `ejecutar_total`).
+    """
+    etapas = {}
+    celda = HOJAS[caso["hoja"]].get("celda", 64)
+
+    with tempfile.TemporaryDirectory() as temporal, redirect_stdout(io.StringIO()):
+        if caso["script"] == "dividir":
+            imagen = medir(etapas, "carga", lambda: dividir.cargar_imagen(ruta_hoja).copy())
+            args = argumentos_dividir(ruta_hoja, os.path.join(temporal, "etapas"), caso["opciones"]["modo"],
+                                      celda, imagen.size)
+            limites = medir(etapas, "deteccion", dividir.calcular_limites, imagen, args)
+            cajas = dividir.cajas_de_recorte(limites, args, imagen.size)
+            recortes = medir(etapas, "recorte", lambda: list(dividir.iterar_recortes(imagen, cajas)))
+            medir(etapas, "escritura", dividir.guardar_sprites, recortes, args.salida, args.nombre, False)
+            num_sprites = len(recortes)
+        else:
+            opciones = caso["opciones"]
+            imagen = medir(etapas, "carga", lambda: aplicar_fondo.cargar_imagen(ruta_hoja).copy())
+            fondo = aplicar_fondo.cargar_imagen(ruta_fondo)
+            num_horizontal, num_vertical = imagen.width // celda, imagen.height // celda
+            resultados = medir(etapas, "composicion", lambda: aplicar_fondo.componer_sprites(
+                imagen, fondo, opciones["modo_ajuste"], num_horizontal, num_vertical, opciones["motor"]))
+            directorio = os.path.join(temporal, "etapas")
+            os.makedirs(directorio)
+            medir(etapas, "escritura", aplicar_fondo.guardar_sprites_compuestos, resultados, directorio, "sprite")
+            num_sprites = len(resultados)
+
+    return {
+        "etapas": etapas,
+        "sprites": num_sprites,
+        "megapixeles": imagen.width * imagen.height / 1e6,
+    }
+
+def ejecutar_total(caso, ruta_hoja, ruta_fondo):
+    """
+    Ejecuta un caso de extremo a extremo con `dividir.procesar_hoja` o
+    `aplicar_fondo.procesar_imagenes`, en flujo como desde la línea de comandos.
+
+    Debe llamarse en un proceso nuevo: devuelve el tiempo total y la memoria
+    residente máxima del proceso, que así es solo la de este caso.
+    """
+    celda = HOJAS[caso["hoja"]].get("celda", 64)
+    with Image.open(ruta_hoja) as imagen:
+        tamaño = imagen.size
+
+    with tempfile.TemporaryDirectory() as temporal, redirect_stdout(io.StringIO()):
+        salida = os.path.join(temporal, "total")
+        if caso["script"] == "dividir":
+            args = argumentos_dividir(ruta_hoja, salida, caso["opciones"]["modo"], celda, tamaño)
+            inicio = time.perf_counter()
+            dividir.procesar_hoja(ruta_hoja, args.salida, args, False)
+            total = time.perf_counter() - inicio
+        else:
+            opciones = caso["opciones"]
+            inicio = time.perf_counter()
+            aplicar_fondo.procesar_imagenes(ruta_hoja, ruta_fondo, salida, "fondo_", opciones["modo_ajuste"],
+                                            tamaño[0] // celda, tamaño[1] // celda, opciones["motor"])
+            total = time.perf_counter() - inicio
+
+    return {"total": total, "memoria_pico_mb": perfil.memoria_pico_mb()}
+
+def ejecutar_caso(caso, ruta_hoja, ruta_fondo, contexto):
+    """
+    Ejecuta un caso etapa a etapa y de extremo a extremo, cada ejecución en un
+    proceso nuevo. Devuelve los resultados de ambas combinados.
+    """
+    medicion = {}
+    for funcion in (ejecutar_etapas, ejecutar_total):
+        with ProcessPoolExecutor(max_workers=1, mp_context=contexto) as ejecutor:
+            medicion.update(ejecutor.submit(funcion, caso, ruta_hoja, ruta_fondo).result())
+    return medicion
+
+def preparar_hojas(directorio, escala=1.0, semilla=0):
+    """Genera (o reutiliza) las hojas sintéticas y el fondo en `directorio`. Devuelve sus rutas."""
+    os.makedirs(directorio, exist_ok=True)
+    rutas = {}
+    for tipo in HOJAS:
+        ruta = os.path.join(directorio, f"{tipo}_{escala:g}_{semilla}.png")
+        if not os.path.exists(ruta):
+            generar_hoja(tipo, escala, semilla).save(ruta)
+        rutas[tipo] = ruta
+    ruta_fondo = os.path.join(directorio, f"fondo_{semilla}.png")
+    if not os.path.exists(ruta_fondo):
+        generar_fondo(semilla).save(ruta_fondo)
+    return rutas, ruta_fondo
+
+def ejecutar_benchmark(directorio_hojas, escala=1.0, semilla=0, repeticiones=3, filtro="*"):
+    """
+    Ejecuta los casos que coinciden con `filtro` y devuelve sus resultados.
+
+    Cada repetición corre en procesos nuevos para que la memoria máxima sea la
+    de la ejecución de extremo a extremo del caso y no la acumulada; se guarda
+    el mejor tiempo de cada etapa.
+    """
+    rutas, ruta_fondo = preparar_hojas(directorio_hojas, escala, semilla)
+    contexto = multiprocessing.get_context("spawn")
+    resultados = {}
+
+    for caso in definir_casos():
+        if not fnmatch.fnmatch(caso["nombre"], filtro):
+            continue
+        mediciones = []
+        for _ in range(max(1, repeticiones)):
+            mediciones.append(ejecutar_caso(caso, rutas[caso["hoja"]], ruta_fondo, contexto))
+
+        mejor = min(mediciones, key=lambda m: m["total"])
+        etapas = {nombre: min(m["etapas"][nombre] for m in mediciones) for nombre in mejor["etapas"]}
+        resultado = {
+            "etapas": etapas,
+            "total": mejor["total"],
+            "sprites": mejor["sprites"],
+            "megapixeles": mejor["megapixeles"],
+            "sprites_por_segundo": mejor["sprites"] / mejor["total"] if mejor["total"] else 0.0,
+            "megapixeles_por_segundo": mejor["megapixeles"] / mejor["total"] if mejor["total"] else 0.0,
+            "memoria_pico_mb": max(m["memoria_pico_mb"] for m in mediciones),
+        }
+        resultados[caso["nombre"]] = resultado
+        print(f"{caso['nombre']:<40} {resultado['total']:8.3f} s {resultado['sprites_por_segundo']:10.0f} sprites/s "
+              f"{resultado['megapixeles_por_segundo']:8.1f} MP/s {resultado['memoria_pico_mb']:8.1f} MB  "
+              + " ".join(f"{nombre}={segundos:.3f}" for nombre, segundos in etapas.items()))
+
+    return resultados
+
+def comparar_resultados(actuales, base, tolerancia=0.10, tolerancia_memoria=0.10):
+    """
+    Compara dos ejecuciones caso a caso y muestra la variación del tiempo total
+    y de la memoria máxima.
+
+    Devuelve la lista de casos que son más lentos que la base en más de
+    `tolerancia`, o que usan más memoria en más de `tolerancia_memoria`.
+    """
+    regresiones = []
+    for nombre, actual in actuales.items():
+        if nombre not in base:
+            print(f"{nombre:<40} (sin base)")
+            continue
+        anterior = base[nombre]["total"]
+        variacion = (actual["total"] - anterior) / anterior if anterior else 0.0
+        memoria_anterior = base[nombre]["memoria_pico_mb"]
+        memoria = actual["memoria_pico_mb"] - memoria_anterior
+        variacion_memoria = memoria / memoria_anterior if memoria_anterior else 0.0
+        regresion = variacion > tolerancia or variacion_memoria > tolerancia_memoria
+        marca = "REGRESIÓN" if regresion else ""
+        print(f"{nombre:<40} {anterior:8.3f} s -> {actual['total']:8.3f} s ({variacion:+7.1%}) "
+              f"memoria {memoria:+8.1f} MB ({variacion_memoria:+7.1%}) {marca}")
+        if regresion:
+            regresiones.append(nombre)
+    return regresiones
+
+def cargar_resultados(ruta):
+    """Lee un archivo de resultados guardado con 'ejecutar --salida'."""
+    with open(ruta, encoding="utf-8") as archivo:
+        return json.load(archivo)["casos"]
+
+def main():
+    parser = argparse.ArgumentParser(description="Mide el rendimiento de dividir.py y aplicar_fondo.py con hojas sintéticas.")
+    subparsers = parser.add_subparsers(dest="comando", required=True)
+
+    generar = subparsers.add_parser("generar", help="Genera las hojas sintéticas en un directorio")
+    generar.add_argument("directorio", help="Directorio donde guardar las hojas")
+    generar.add_argument("--escala", type=float, default=1.0, help="Factor de tamaño de las hojas (predeterminado: 1)")
+    generar.add_argument("--semilla", type=int, default=0, help="Semilla del generador aleatorio (predeterminado: 0)")
+
+    ejecutar = subparsers.add_parser("ejecutar", help="Ejecuta los casos y guarda los resultados")
+    ejecutar.add_argument("--hojas", default=os.path.join(tempfile.gettempdir(), "paleta_benchmark"),
+                          help="Directorio de las hojas sintéticas; se generan si no existen")
+    ejecutar.add_argument("--escala", type=float, default=1.0, help="Factor de tamaño de las hojas (predeterminado: 1)")
+    ejecutar.add_argument("--semilla", type=int, default=0, help="Semilla del generador aleatorio (predeterminado: 0)")
+    ejecutar.add_argument("--repeticiones", type=int, default=3,
+                          help="Repeticiones de cada caso; se guarda la mejor (predeterminado: 3)")
+    ejecutar.add_argument("--casos", default="*", help="Patrón de los casos a ejecutar, p. ej. 'dividir/*/auto'")
+    ejecutar.add_argument("--salida", default="benchmark_resultados.json",
+                          help="Archivo JSON de resultados; sirve como base para 'comparar'")
+    ejecutar.add_argument("--base", default=None, help="Archivo de resultados con el que comparar al terminar")
+    ejecutar.add_argument("--tolerancia", type=float, default=0.10,
+                          help="Variación máxima del tiempo total antes de considerarla regresión (predeterminado: 0.10)")
+    ejecutar.add_argument("--tolerancia_memoria", type=float, default=0.10,
+                          help="Variación máxima de la memoria máxima antes de considerarla regresión "
+                               "(predeterminado: 0.10)")
+
+    comparar = subparsers.add_parser("comparar", help="Compara dos archivos de resultados")
+    comparar.add_argument("actual", help="Resultados actuales")
+    comparar.add_argument("base", help="Resultados de referencia")
+    comparar.add_argument("--tolerancia", type=float, default=0.10,
+                          help="Variación máxima del tiempo total antes de considerarla regresión (predeterminado: 0.10)")
+    comparar.add_argument("--tolerancia_memoria", type=float, default=0.10,
+                          help="Variación máxima de la memoria máxima antes de considerarla regresión "
+                               "(predeterminado: 0.10)")
+
+    args = parser.parse_args()
+
+    if args.comando == "generar":
+        rutas, ruta_fondo = preparar_hojas(args.directorio, args.escala, args.semilla)
+        for ruta in list(rutas.values()) + [ruta_fondo]:
+            print(f"Hoja generada: {ruta}")
+        return
+
+    if args.comando == "ejecutar":
+        resultados = ejecutar_benchmark(args.hojas, args.escala, args.semilla, args.repeticiones, args.casos)
+        with open(args.salida, "w", encoding="utf-8") as archivo:
+            json.dump({"escala": args.escala, "semilla": args.semilla, "casos": resultados},
+                      archivo, ensure_ascii=False, indent=2)
+        print(f"Resultados guardados en: {args.salida}")
+        if args.base is None:
+            return
+        regresiones = comparar_resultados(resultados, cargar_resultados(args.base), args.tolerancia,
+                                          args.tolerancia_memoria)
+    else:
+        regresiones = comparar_resultados(cargar_resultados(args.actual), cargar_resultados(args.base),
+                                          args.tolerancia, args.tolerancia_memoria)
+
+    if regresiones:
+        print(f"Se han detectado {len(regresiones)} regresiones.")
+        sys.exit(1)
+    print("Sin regresiones.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import os
+import sys
+import json
+import argparse
+import importlib
+from servidor import HERRAMIENTAS, conectar, direccion_predeterminada, enviar
+
+def enviar_trabajo(conexion, herramienta, argumentos):
+    """
+    Envía un trabajo por una conexión ya abierta con el servidor y muestra su
+    salida según llega. Devuelve el código de salida del trabajo.
+    """
+    try:
+        with conexion, conexion.makefile("rwb") as archivo:
+            enviar(archivo, {"herramienta": herramienta, "argumentos": argumentos, "directorio": os.getcwd()})
+            for linea in archivo:
+                mensaje = json.loads(linea)
+                if "codigo" in mensaje:
+                    return mensaje["codigo"]
+                destino = sys.stderr if mensaje["flujo"] == "stderr" else sys.stdout
+                destino.write(mensaje["texto"])
+                destino.flush()
+    except OSError:
+        # El servidor puede haber hecho ya parte del trabajo, así que no se repite aquí
+        pass
+    print("El servidor cerró la conexión antes de terminar el trabajo.", file=sys.stderr)
+    return 1
+
+def ejecutar_localmente(herramienta, argumentos):
+    """Ejecuta la herramienta en este mismo proceso, como si se hubiera llamado directamente."""
+    sys.argv = [f"{herramienta}.py", *argumentos]
+    importlib.import_module(herramienta).main(argumentos)
+    return 0
+
+def crear_parser():
+    """Crea el parser de argumentos de la línea de comandos."""
+    parser = argparse.ArgumentParser(
+        description="Envía un trabajo al servidor (servidor.py) con los mismos argumentos que la herramienta. "
+                    "Ejemplo: python cliente.py dividir hoja.png --modo auto")
+    parser.add_argument("--direccion", default=direccion_predeterminada(),
+                        help="Ruta del socket Unix o puerto local del servidor "
+                             f"(predeterminado: '{direccion_predeterminada()}')")
+    parser.add_argument("--sin_respaldo", action="store_true",
+                        help="Falla si no hay servidor en lugar de ejecutar el trabajo en este proceso")
+    parser.add_argument("--detener", action="store_true",
+                        help="Detiene el servidor")
+    parser.add_argument("herramienta", nargs="?", choices=HERRAMIENTAS,
+                        help="Herramienta a ejecutar")
+    parser.add_argument("argumentos", nargs=argparse.REMAINDER,
+                        help="Argumentos de la herramienta, los mismos que acepta directamente (prueba '--help')")
+    return parser
+
+def main():
+    parser = crear_parser()
+    args = parser.parse_args()
+
+    if args.detener:
+        try:
+            with conectar(args.direccion) as conexion, conexion.makefile("rwb") as archivo:
+                enviar(archivo, {"orden": "detener"})
+                archivo.readline()
+        except OSError:
+            print(f"No hay ningún servidor en {args.direccion}.")
+        return
+
+    if not args.herramienta:
+        parser.error("indica la herramienta a ejecutar")
+
+    try:
+        conexion = conectar(args.direccion)
+    except OSError:
+        if args.sin_respaldo:
+            print(f"No hay ningún servidor en {args.direccion}. Inícialo con 'python servidor.py'.", file=sys.stderr)
+            sys.exit(1)
+        # Sin servidor el trabajo se hace igualmente, solo que pagando el arranque completo
+        sys.exit(ejecutar_localmente(args.herramienta, args.argumentos))
+    sys.exit(enviar_trabajo(conexion, args.herramienta, args.argumentos))
+
+if __name__ == "__main__":
+    main()
@@ -1,104 +1,311 @@
 import os
+import glob
+import json
+import time
 import argparse
-from PIL import Image
-import numpy as np
+from duplicados import Deduplicador, encadenar_filtros
+from escritura import COMPRESION_PREDETERMINADA, Progreso, escribir_imagenes
+from hoja_grande import ALTO_BANDA_PREDETERMINADO, HojaGrande, cargar_hoja_grande
+from incremental import Manifiesto, calcular_clave
+from nucleo import EXTENSIONES_IMAGEN, cargar_imagen, detectar_sprites_por_numero, iterar_recortes, limites_por_numero
+from nucleo import agregar_opciones_comunes, perfil_de_ejecucion, validar_opciones_comunes
+from paleta import MAX_COLORES, Paleta, calcular_paleta
+from perezoso import importar_perezoso
+from piramide import construir_piramide, directorio_escala, escalar_cajas
+import perfil
 
-def cargar_imagen(ruta_imagen):
-    """Carga una imagen desde una ruta especificada."""
-    try:
-        imagen = Image.open(ruta_imagen)
-        if imagen.mode != "RGBA" and "A" in imagen.getbands():
-            imagen = imagen.convert("RGBA")
+# NumPy, PIL y el atlas solo se importan al usarlos, para que --help y los
+# trabajos pequeños arranquen rápido
+np = importar_perezoso("numpy")
+atlas = importar_perezoso("atlas")
+
+def obtener_alpha(imagen):
+    """
+    Devuelve el canal alpha de la imagen como un array 2D de NumPy.
+
+    Acepta una imagen de PIL, un array HxWx4 (se devuelve una vista del canal
+    alpha, sin copiar) o un array HxW que ya sea el canal alpha. Si la imagen no
+    tiene canal alpha se considera completamente opaca.
+    """
+    if isinstance(imagen, np.ndarray):
+        if imagen.ndim == 3:
+            if imagen.shape[2] < 4:
+                return np.full(imagen.shape[:2], 255, dtype=np.uint8)
+            return imagen[:, :, 3]
         return imagen
-    except Exception as e:
-        print(f"Error al cargar la imagen: {e}")
-        return None
 
-def detectar_sprites_horizontal(imagen):
+    if "A" not in imagen.getbands():
+        return np.full((imagen.height, imagen.width), 255, dtype=np.uint8)
+    # Solo se copia el canal alpha, no los cuatro canales de la imagen
+    return np.asarray(imagen.getchannel("A"))
+
+def calcular_proyecciones(imagen, umbral_alpha=0):
+    """
+    Calcula en una sola pasada las proyecciones del canal alpha.
+
+    Devuelve dos arrays booleanos: uno por columna y otro por fila, que indican
+    si contienen algún píxel con alpha mayor que `umbral_alpha`.
+    """
+    if isinstance(imagen, HojaGrande):
+        # Las proyecciones se acumulan banda a banda sin cargar la hoja entera
+        columnas = np.zeros(imagen.width, dtype=bool)
+        filas = np.zeros(imagen.height, dtype=bool)
+        for y, banda in imagen.bandas():
+            mascara = banda[:, :, 3] > umbral_alpha
+            columnas |= mascara.any(axis=0)
+            filas[y:y + len(banda)] = mascara.any(axis=1)
+        return columnas, filas
+    
+    mascara = obtener_alpha(imagen) > umbral_alpha
+    return mascara.any(axis=0), mascara.any(axis=1)
+
+def detectar_bandas(proyeccion, separacion_minima=1, ancho_minimo=1):
+    """
+    Encuentra las bandas (inicio, fin) de valores verdaderos en una proyección.
+
+    - separacion_minima: los huecos más estrechos que este valor se unen a las bandas vecinas
+    - ancho_minimo: se descartan las bandas más estrechas que este valor
+    """
+    proyeccion = np.asarray(proyeccion, dtype=bool)
+    # Rodear de falsos para que cada banda tenga un cambio de subida y otro de bajada
+    relleno = np.concatenate(([False], proyeccion, [False]))
+    cambios = np.flatnonzero(relleno[1:] != relleno[:-1])
+    inicios = cambios[0::2]
+    fines = cambios[1::2]
+
+    if separacion_minima > 1 and len(inicios) > 1:
+        cortes = (inicios[1:] - fines[:-1]) >= separacion_minima
+        inicios = np.concatenate((inicios[:1], inicios[1:][cortes]))
+        fines = np.concatenate((fines[:-1][cortes], fines[-1:]))
+
+    if ancho_minimo > 1:
+        validas = (fines - inicios) >= ancho_minimo
+        inicios = inicios[validas]
+        fines = fines[validas]
+
+    return list(zip(inicios.tolist(), fines.tolist()))
+
+def detectar_bandas_sprites(imagen, umbral_alpha=0, separacion_minima=1, ancho_minimo=1):
+    """Detecta a la vez los límites horizontales y verticales de los sprites de una imagen."""
+    columnas, filas = calcular_proyecciones(imagen, umbral_alpha)
+    limites_horizontales = detectar_bandas(columnas, separacion_minima, ancho_minimo)
+    limites_verticales = detectar_bandas(filas, separacion_minima, ancho_minimo)
+    return limites_horizontales, limites_verticales
+
+def detectar_sprites_horizontal(imagen, umbral_alpha=0, separacion_minima=1, ancho_minimo=1):
     """Detecta los límites horizontales de cada sprite en una imagen."""
-    datos = np.array(imagen)
-    altura, anchura = datos.shape[:2]
-    
-    # Buscar columnas que tienen píxeles no transparentes
-    columnas_no_vacias = []
-    inicio_sprite = None
-    
-    for x in range(anchura):
-        # Comprueba si hay píxeles no transparentes en esta columna
-        columna = datos[:, x, 3]  # Canal alpha
-        if np.any(columna > 0):  # Hay píxeles no transparentes
-            if inicio_sprite is None:
-                inicio_sprite = x
-        elif inicio_sprite is not None:
-            # Hemos encontrado el final de un sprite
-            columnas_no_vacias.append((inicio_sprite, x))
-            inicio_sprite = None
-    
-    # Comprobar si hay un sprite que llega hasta el borde derecho
-    if inicio_sprite is not None:
-        columnas_no_vacias.append((inicio_sprite, anchura))
-    
-    return columnas_no_vacias
-
-def detectar_sprites_vertical(imagen):
+    columnas, _ = calcular_proyecciones(imagen, umbral_alpha)
+    return detectar_bandas(columnas, separacion_minima, ancho_minimo)
+
+def detectar_sprites_vertical(imagen, umbral_alpha=0, separacion_minima=1, ancho_minimo=1):
     """Detecta los límites verticales de cada sprite en una imagen."""
-    datos = np.array(imagen)
-    altura, anchura = datos.shape[:2]
-    
-    # Buscar filas que tienen píxeles no transparentes
-    filas_no_vacias = []
-    inicio_sprite = None
-    
-    for y in range(altura):
-        # Comprueba si hay píxeles no transparentes en esta fila
-        fila = datos[y, :, 3]  # Canal alpha
-        if np.any(fila > 0):  # Hay píxeles no transparentes
-            if inicio_sprite is None:
-                inicio_sprite = y
-        elif inicio_sprite is not None:
-            # Hemos encontrado el final de un sprite
-            filas_no_vacias.append((inicio_sprite, y))
-            inicio_sprite = None
-    
-    # Comprobar si hay un sprite que llega hasta el borde inferior
-    if inicio_sprite is not None:
-        filas_no_vacias.append((inicio_sprite, altura))
-    
-    return filas_no_vacias
-
-def detectar_sprites(imagen):
+    _, filas = calcular_proyecciones(imagen, umbral_alpha)
+    return detectar_bandas(filas, separacion_minima, ancho_minimo)
+
+def detectar_sprites(imagen, umbral_alpha=0, separacion_minima=1, ancho_minimo=1):
     """Detecta los límites de cada sprite en una imagen, tanto horizontal como verticalmente."""
-    limites_horizontales = detectar_sprites_horizontal(imagen)
-    limites_verticales = detectar_sprites_vertical(imagen)
+    limites = detectar_limites(imagen, umbral_alpha, separacion_minima, ancho_minimo)
+    return list(iterar_recortes(imagen, limites)), limites
+
+def detectar_limites(imagen, umbral_alpha=0, separacion_minima=1, ancho_minimo=1):
+    """Combina las bandas horizontales y verticales en límites (x1, y1, x2, y2)."""
+    limites_horizontales, limites_verticales = detectar_bandas_sprites(
+        imagen, umbral_alpha, separacion_minima, ancho_minimo)
     
-    sprites = []
     limites = []
-    
     for x_inicio, x_fin in limites_horizontales:
         for y_inicio, y_fin in limites_verticales:
-            sprite = imagen.crop((x_inicio, y_inicio, x_fin, y_fin))
-            sprites.append(sprite)
             limites.append((x_inicio, y_inicio, x_fin, y_fin))
     
-    return sprites, limites
+    return limites
+
+def extraer_tramos(mascara):
+    """
+    Codifica por longitud de tramo cada fila de una máscara booleana.
+
+    Devuelve tres arrays (filas, inicios, fines) con un elemento por cada tramo
+    horizontal de píxeles verdaderos, ordenados por fila y después por columna.
+    """
+    alto, ancho = mascara.shape
+    relleno = np.zeros((alto, ancho + 2), dtype=bool)
+    relleno[:, 1:-1] = mascara
+    # Cada fila empieza y acaba en falso, así que los cambios van por parejas
+    cambios = np.flatnonzero(relleno[:, 1:] != relleno[:, :-1])
+    filas = cambios[0::2] // (ancho + 1)
+    inicios = cambios[0::2] % (ancho + 1)
+    fines = cambios[1::2] % (ancho + 1)
+    return filas, inicios, fines
+
+def dilatar_mascara(mascara, distancia):
+    """Extiende cada píxel verdadero `distancia` píxeles hacia la derecha y hacia abajo."""
+    dilatada = mascara.copy()
+    for eje in (0, 1):
+        cubierto = 1
+        while cubierto < distancia + 1:
+            paso = min(cubierto, distancia + 1 - cubierto)
+            if eje == 0:
+                dilatada[paso:] |= dilatada[:-paso].copy()
+            else:
+                dilatada[:, paso:] |= dilatada[:, :-paso].copy()
+            cubierto += paso
+    return dilatada
+
+def extraer_tramos_por_bandas(hoja, umbral_alpha=0, distancia=0):
+    """
+    Extrae los tramos de una HojaGrande banda a banda.
+
+    Con `distancia` mayor que 0 se extraen los tramos de la máscara dilatada;
+    cada banda se amplía hacia arriba con las `distancia` filas anteriores para
+    que la dilatación sea la misma que sobre la hoja completa.
+    """
+    partes = []
+    for y, banda in hoja.bandas():
+        inicio = max(0, y - distancia)
+        mascara = hoja.datos[inicio:y + len(banda), :, 3] > umbral_alpha
+        if distancia > 0:
+            mascara = dilatar_mascara(mascara, distancia)
+        filas, inicios, fines = extraer_tramos(mascara[y - inicio:])
+        partes.append((filas + y, inicios, fines))
+    
+    if not partes:
+        vacio = np.zeros(0, dtype=np.int64)
+        return vacio, vacio, vacio
+    return tuple(np.concatenate(columna) for columna in zip(*partes))
+
+def conectar_tramos(filas, inicios, fines, ancho):
+    """
+    Devuelve las parejas de tramos de filas consecutivas que se tocan (8-conectividad).
 
-def recortar_sprites(imagen, modo='horizontal'):
+    Un tramo [s, e) de la fila y toca a un tramo [s2, e2) de la fila y-1 si s2 <= e y s <= e2.
+    """
+    clave = ancho + 1
+    claves_fin = filas * clave + fines
+    claves_inicio = filas * clave + inicios
+    # Para cada tramo, rango de tramos de la fila anterior que lo tocan
+    primeros = np.searchsorted(claves_fin, (filas - 1) * clave + inicios, side="left")
+    ultimos = np.searchsorted(claves_inicio, (filas - 1) * clave + fines, side="right")
+    cuentas = np.maximum(ultimos - primeros, 0)
+    total = int(cuentas.sum())
+    if total == 0:
+        vacio = np.zeros(0, dtype=np.int64)
+        return vacio, vacio
+
+    tramos_b = np.repeat(np.arange(len(filas)), cuentas)
+    desplazamientos = np.arange(total) - np.repeat(np.cumsum(cuentas) - cuentas, cuentas)
+    tramos_a = np.repeat(primeros, cuentas) + desplazamientos
+    return tramos_a, tramos_b
+
+def etiquetar_tramos(num_tramos, tramos_a, tramos_b):
+    """
+    Agrupa los tramos en componentes conexas mediante unión-búsqueda vectorizada.
+
+    Devuelve para cada tramo el índice del tramo raíz de su componente.
+    """
+    padre = np.arange(num_tramos)
+    while len(tramos_a):
+        raices_a = padre[tramos_a]
+        raices_b = padre[tramos_b]
+        distintas = raices_a != raices_b
+        if not distintas.any():
+            break
+        tramos_a, tramos_b = tramos_a[distintas], tramos_b[distintas]
+        raices_a, raices_b = raices_a[distintas], raices_b[distintas]
+
+        # Colgar siempre la raíz mayor de la menor para que no haya ciclos
+        np.minimum.at(padre, np.maximum(raices_a, raices_b), np.minimum(raices_a, raices_b))
+
+        # Compresión de caminos hasta que todos apunten a su raíz
+        while True:
+            abuelos = padre[padre]
+            if np.array_equal(abuelos, padre):
+                break
+            padre = abuelos
+    return padre
+
+def detectar_componentes(imagen, umbral_alpha=0, distancia_union=0):
+    """
+    Detecta los límites de cada región opaca conectada de una imagen.
+
+    Las regiones separadas por `distancia_union` píxeles transparentes o menos se
+    consideran un mismo sprite. Devuelve una lista de límites (x1, y1, x2, y2)
+    ordenada de arriba abajo y de izquierda a derecha.
+    """
+    if isinstance(imagen, HojaGrande):
+        alto, ancho = imagen.height, imagen.width
+        
+        def tramos(distancia):
+            return extraer_tramos_por_bandas(imagen, umbral_alpha, distancia)
+    else:
+        mascara = obtener_alpha(imagen) > umbral_alpha
+        alto, ancho = mascara.shape
+        
+        def tramos(distancia):
+            return extraer_tramos(dilatar_mascara(mascara, distancia) if distancia > 0 else mascara)
+    
+    filas, inicios, fines = tramos(0)
+    if len(filas) == 0:
+        return []
+
+    if distancia_union > 0:
+        # Las componentes se calculan sobre la máscara dilatada, pero las cajas
+        # se ajustan con los tramos originales
+        filas_d, inicios_d, fines_d = tramos(distancia_union)
+        tramos_a, tramos_b = conectar_tramos(filas_d, inicios_d, fines_d, ancho)
+        raices_d = etiquetar_tramos(len(filas_d), tramos_a, tramos_b)
+        contenedores = np.searchsorted(filas_d * (ancho + 1) + inicios_d,
+                                       filas * (ancho + 1) + inicios, side="right") - 1
+        raices = raices_d[contenedores]
+    else:
+        tramos_a, tramos_b = conectar_tramos(filas, inicios, fines, ancho)
+        raices = etiquetar_tramos(len(filas), tramos_a, tramos_b)
+
+    _, etiquetas = np.unique(raices, return_inverse=True)
+    num_componentes = int(etiquetas.max()) + 1
+
+    x1 = np.full(num_componentes, ancho, dtype=np.int64)
+    y1 = np.full(num_componentes, alto, dtype=np.int64)
+    x2 = np.zeros(num_componentes, dtype=np.int64)
+    y2 = np.zeros(num_componentes, dtype=np.int64)
+    np.minimum.at(x1, etiquetas, inicios)
+    np.minimum.at(y1, etiquetas, filas)
+    np.maximum.at(x2, etiquetas, fines)
+    np.maximum.at(y2, etiquetas, filas + 1)
+
+    orden = np.lexsort((x1, y1))
+    return list(zip(x1[orden].tolist(), y1[orden].tolist(), x2[orden].tolist(), y2[orden].tolist()))
+
+def detectar_sprites_componentes(imagen, umbral_alpha=0, distancia_union=0):
+    """Recorta un sprite por cada región opaca conectada de la imagen."""
+    limites = detectar_componentes(imagen, umbral_alpha, distancia_union)
+    return list(iterar_recortes(imagen, limites)), limites
+
+def recortar_sprites(imagen, modo='horizontal', umbral_alpha=0, separacion_minima=1, ancho_minimo=1):
     """Recorta los sprites individuales de la imagen."""
     if modo == 'horizontal':
-        limites = detectar_sprites_horizontal(imagen)
-        sprites = [imagen.crop((x_inicio, 0, x_fin, imagen.height)) for x_inicio, x_fin in limites]
+        limites = detectar_sprites_horizontal(imagen, umbral_alpha, separacion_minima, ancho_minimo)
     else:  # vertical
-        limites = detectar_sprites_vertical(imagen)
-        sprites = [imagen.crop((0, y_inicio, imagen.width, y_fin)) for y_inicio, y_fin in limites]
+        limites = detectar_sprites_vertical(imagen, umbral_alpha, separacion_minima, ancho_minimo)
     
+    sprites = list(iterar_recortes(imagen, cajas_de_bandas(limites, modo, imagen.size)))
     return sprites, limites
 
+def cajas_de_bandas(limites, modo, tamaño_imagen):
+    """Convierte bandas (inicio, fin) en límites (x1, y1, x2, y2) que ocupan toda la imagen en el otro eje."""
+    ancho_imagen, alto_imagen = tamaño_imagen
+    if modo == 'horizontal':
+        return [(x_inicio, 0, x_fin, alto_imagen) for x_inicio, x_fin in limites]
+    return [(0, y_inicio, ancho_imagen, y_fin) for y_inicio, y_fin in limites]
+
 def dividir_sprites_fijos(imagen, ancho, alto):
     """Divide una imagen en sprites de tamaño fijo."""
-    sprites = []
+    limites = limites_fijos(imagen.size, ancho, alto)
+    return list(iterar_recortes(imagen, limites)), limites
+
+def limites_fijos(tamaño_imagen, ancho, alto):
+    """Calcula los límites de una división en sprites de tamaño fijo."""
     limites = []
     
-    imagen_ancho, imagen_alto = imagen.size
+    imagen_ancho, imagen_alto = tamaño_imagen
     
     # Calcula cuántos sprites caben en la imagen
     num_sprites_x = imagen_ancho // ancho
@@ -111,49 +318,374 @@ def dividir_sprites_fijos(imagen, ancho, alto):
             right = left + ancho
             lower = upper + alto
             
-            sprite = imagen.crop((left, upper, right, lower))
-            sprites.append(sprite)
             limites.append((left, upper, right, lower))
     
-    return sprites, limites
+    return limites
 
-def detectar_sprites_por_numero(imagen, num_horizontal, num_vertical):
-    """Detecta los límites de cada sprite en una imagen basado en el número de sprites horizontal y verticalmente."""
-    imagen_ancho, imagen_alto = imagen.size
-    ancho_sprite = imagen_ancho // num_horizontal
-    alto_sprite = imagen_alto // num_vertical
+def guardar_sprites(sprites, directorio_salida, nombre_base, detallado=True, en_vuelo=8,
+                    hilos=None, compresion=COMPRESION_PREDETERMINADA, optimizar=False, filtro=None):
+    """
+    Guarda los sprites recortados como archivos individuales.
+    
+    `sprites` puede ser un generador: cada sprite se guarda a medida que se
+    produce, con como mucho `en_vuelo` sprites pendientes de escribir. La
+    codificación PNG se reparte entre `hilos` hilos. Con `filtro` (ver
+    `Manifiesto.filtro`) solo se escriben los sprites que han cambiado.
+    """
+    os.makedirs(directorio_salida, exist_ok=True)
     
+    elementos = ((os.path.join(directorio_salida, f"{nombre_base}_{i+1}.png"), sprite)
+                 for i, sprite in enumerate(sprites))
+    if filtro:
+        elementos = filtro(elementos)
+    progreso = Progreso("Sprites guardados", activo=detallado)
+    total = escribir_imagenes(elementos, compresion, optimizar, hilos, en_vuelo, progreso)
+    progreso.terminar(directorio_salida)
+    return total
+
+def validar_argumentos(args):
+    """Comprueba los argumentos que dependen del modo. Devuelve un mensaje de error o None."""
+    if args.modo == "fijo" and (args.ancho <= 0 or args.alto <= 0):
+        return "Error: Para el modo 'fijo', debe proporcionar un ancho y alto válidos (mayores que 0)."
+    if args.modo == "numero" and (args.num_horizontal <= 0 or args.num_vertical <= 0):
+        return "Error: Para el modo 'numero', debe proporcionar un número válido de sprites horizontal y verticalmente (mayores que 0)."
+    return validar_opciones_comunes(args)
+
+def calcular_limites(imagen, args):
+    """Calcula los límites de los sprites según el modo indicado en los argumentos."""
+    if args.modo == "fijo":
+        return limites_fijos(imagen.size, args.ancho, args.alto)
+    elif args.modo == "auto":
+        return detectar_limites(imagen, args.umbral_alpha, args.separacion_minima, args.ancho_minimo)
+    elif args.modo == "componentes":
+        return detectar_componentes(imagen, args.umbral_alpha, args.distancia_union)
+    elif args.modo == "numero":
+        return limites_por_numero(imagen.size, args.num_horizontal, args.num_vertical)
+    elif args.modo == "horizontal":
+        return detectar_sprites_horizontal(imagen, args.umbral_alpha, args.separacion_minima, args.ancho_minimo)
+    else:
+        return detectar_sprites_vertical(imagen, args.umbral_alpha, args.separacion_minima, args.ancho_minimo)
+
+def cajas_de_recorte(limites, args, tamaño_imagen):
+    """Devuelve los límites como cajas (x1, y1, x2, y2) listas para recortar."""
+    if args.modo in ("horizontal", "vertical"):
+        return cajas_de_bandas(limites, args.modo, tamaño_imagen)
+    return limites
+
+def ajustar_cajas(imagen, cajas, umbral_alpha=0):
+    """
+    Reduce cada caja a la caja mínima que contiene sus píxeles con alpha mayor que `umbral_alpha`.
+
+    Devuelve las cajas ajustadas y el índice de la caja original de cada una.
+    Las cajas sin ningún píxel opaco se descartan.
+    """
+    # En una hoja grande solo se leen del disco las filas de cada caja
+    alpha = imagen.datos[:, :, 3] if isinstance(imagen, HojaGrande) else obtener_alpha(imagen)
+    ajustadas = []
+    indices = []
+    for i, (x1, y1, x2, y2) in enumerate(cajas):
+        xa, ya = max(x1, 0), max(y1, 0)
+        mascara = alpha[ya:max(ya, y2), xa:max(xa, x2)] > umbral_alpha
+        columnas = np.flatnonzero(mascara.any(axis=0))
+        if len(columnas) == 0:
+            continue
+        filas = np.flatnonzero(mascara.any(axis=1))
+        ajustadas.append((xa + int(columnas[0]), ya + int(filas[0]), xa + int(columnas[-1]) + 1, ya + int(filas[-1]) + 1))
+        indices.append(i)
+    return ajustadas, indices
+
+def guardar_ajuste(directorio_salida, nombre_base, celdas, ajustadas, indices):
+    """
+    Escribe '<nombre_base>_ajuste.json' con, para cada sprite guardado, la celda
+    de la que sale, su desplazamiento dentro de ella y el tamaño original de la
+    celda, de forma que pueda volver a colocarse en su sitio. Devuelve la ruta.
+    """
     sprites = []
-    limites = []
+    for n, (caja, i) in enumerate(zip(ajustadas, indices)):
+        x1, y1, x2, y2 = celdas[i]
+        sprites.append({
+            "sprite": n + 1,
+            "celda": i + 1,
+            "limites": list(caja),
+            "desplazamiento": [caja[0] - x1, caja[1] - y1],
+            "tamaño_celda": [x2 - x1, y2 - y1],
+        })
     
-    for y in range(num_vertical):
-        for x in range(num_horizontal):
-            left = x * ancho_sprite
-            upper = y * alto_sprite
-            right = left + ancho_sprite
-            lower = upper + alto_sprite
-            
-            sprite = imagen.crop((left, upper, right, lower))
-            sprites.append(sprite)
-            limites.append((left, upper, right, lower))
+    os.makedirs(directorio_salida, exist_ok=True)
+    ruta = os.path.join(directorio_salida, f"{nombre_base}_ajuste.json")
+    with open(ruta, "w", encoding="utf-8") as archivo:
+        json.dump({"celdas": len(celdas), "vacias": len(celdas) - len(ajustadas), "sprites": sprites},
+                  archivo, ensure_ascii=False, indent=2)
+    return ruta
+
+def mostrar_limites(limites, args):
+    """Muestra por pantalla los límites de los sprites obtenidos."""
+    if args.modo == "fijo":
+        print(f"Se han generado {len(limites)} sprites con dimensiones {args.ancho}x{args.alto} píxeles.")
+    elif args.modo == "numero":
+        print(f"Se han generado {len(limites)} sprites con {args.num_horizontal}x{args.num_vertical} divisiones.")
+    else:
+        print(f"Se han detectado {len(limites)} sprites.")
     
-    return sprites, limites
+    for i, limite in enumerate(limites):
+        if args.modo == "horizontal":
+            print(f"Sprite {i+1}: Desde x={limite[0]} hasta x={limite[1]}")
+        elif args.modo == "vertical":
+            print(f"Sprite {i+1}: Desde y={limite[0]} hasta y={limite[1]}")
+        else:
+            left, upper, right, lower = limite
+            print(f"Sprite {i+1}: Coordenadas (x1={left}, y1={upper}, x2={right}, y2={lower})")
+
+# Argumentos que no cambian el contenido de la salida y no cuentan para el modo incremental.
+# --hoja_grande sí cuenta: con hojas de paleta o en otros modos los sprites salen en RGBA.
+ARGUMENTOS_SIN_EFECTO = {"imagen", "salida", "alto_banda", "cache_bruta", "en_vuelo", "hilos",
+                         "procesos", "perfil", "perfil_salida", "perfil_cprofile", "incremental"}
+
+def parametros_de_salida(args):
+    """Devuelve los argumentos que afectan a los archivos generados."""
+    return {clave: valor for clave, valor in vars(args).items() if clave not in ARGUMENTOS_SIN_EFECTO}
+
+def procesar_hoja(ruta_imagen, directorio_salida, args, detallado=True, transformar=None):
+    """
+    Carga, divide y guarda una hoja de sprites.
+
+    Devuelve un diccionario con el resumen del resultado, de forma que pueda
+    enviarse de vuelta desde un proceso del lote.
+
+    Con --incremental, la hoja se omite si ni ella ni los argumentos han cambiado
+    desde la última ejecución, y si no, solo se reescriben los sprites distintos.
+
+    `transformar` recibe el iterable de recortes y genera los sprites que se
+    guardan en su lugar, del mismo tamaño (ver `aplicar_fondo.AplicadorFondo`).
+    Sus `rutas_entrada` cuentan también para el modo incremental.
+    """
+    resumen = {"imagen": ruta_imagen, "salida": directorio_salida, "sprites": 0, "limites": [], "error": None,
+               "sin_cambios": False}
+    
+    manifiesto = None
+    if args.incremental:
+        manifiesto = Manifiesto(directorio_salida)
+        rutas_entrada = [ruta_imagen] + (transformar.rutas_entrada if transformar else [])
+        clave = calcular_clave(rutas_entrada, parametros_de_salida(args))
+        anterior = manifiesto.sin_cambios(ruta_imagen, clave)
+        if anterior:
+            if detallado:
+                print(f"Sin cambios: {ruta_imagen}")
+            resumen.update(sprites=anterior["sprites"], limites=anterior["limites"], sin_cambios=True)
+            return resumen
+        manifiesto.iniciar_hoja(ruta_imagen, [args.compresion, args.optimizar, args.paleta])
+    
+    with perfil.etapa("carga", imagen=ruta_imagen):
+        if args.hoja_grande:
+            imagen = cargar_hoja_grande(ruta_imagen, args.cache_bruta, args.alto_banda)
+        else:
+            imagen = cargar_imagen(ruta_imagen)
+            if imagen:
+                # Decodificar aquí para que el coste no se atribuya a la detección
+                imagen.load()
+    if not imagen:
+        resumen["error"] = "No se pudo cargar la imagen"
+        return resumen
+    
+    with perfil.etapa("deteccion", imagen=ruta_imagen):
+        limites = calcular_limites(imagen, args)
+    if detallado:
+        mostrar_limites(limites, args)
+    
+    cajas = cajas_de_recorte(limites, args, imagen.size)
+    celdas, indices = cajas, None
+    if args.ajustar_recorte:
+        with perfil.etapa("ajuste", imagen=ruta_imagen):
+            cajas, indices = ajustar_cajas(imagen, celdas, args.umbral_alpha)
+        if detallado:
+            print(f"Recorte ajustado: {len(cajas)} sprites, {len(celdas) - len(cajas)} celdas vacías descartadas")
+    
+    # Con varias escalas, los límites detectados a resolución completa se llevan
+    # a cada nivel de la pirámide y cada escala se guarda en su subdirectorio
+    if args.escalas:
+        niveles = perfil.medir_iterable("piramide", construir_piramide(imagen, args.escalas), imagen=ruta_imagen)
+    else:
+        niveles = [(1, imagen)]
+    for escala, nivel in niveles:
+        directorio = directorio_escala(directorio_salida, escala) if args.escalas else directorio_salida
+        cajas_nivel, celdas_nivel = cajas, celdas
+        if nivel is not imagen:
+            cajas_nivel = escalar_cajas(cajas, imagen.size, nivel.size)
+            celdas_nivel = escalar_cajas(celdas, imagen.size, nivel.size)
+        if args.ajustar_recorte:
+            ruta_ajuste = guardar_ajuste(directorio, args.nombre, celdas_nivel, cajas_nivel, indices)
+            if manifiesto:
+                manifiesto.anotar(ruta_imagen, ruta_ajuste)
+        guardar_nivel(ruta_imagen, nivel, cajas_nivel, directorio, args, detallado, transformar, manifiesto,
+                      es_original=nivel is imagen)
+    
+    resumen["sprites"] = len(cajas)
+    resumen["limites"] = [list(limite) for limite in limites]
+    if manifiesto:
+        sin_cambios, eliminados = manifiesto.cerrar_hoja(ruta_imagen, clave, sprites=resumen["sprites"],
+                                                         limites=resumen["limites"])
+        manifiesto.guardar()
+        if detallado:
+            print(f"Incremental: {sin_cambios} sprites sin cambios, {eliminados} archivos antiguos eliminados")
+    return resumen
+
+def guardar_nivel(ruta_imagen, imagen, cajas, directorio_salida, args, detallado=True, transformar=None,
+                  manifiesto=None, es_original=True):
+    """
+    Recorta las cajas de una hoja (o de un nivel reducido de ella) y guarda los
+    sprites en el formato indicado en los argumentos.
+    
+    Los recortes se generan de uno en uno y se escriben según se producen.
+    """
+    recortes = perfil.medir_iterable("recorte", iterar_recortes(imagen, cajas), imagen=ruta_imagen)
+    if transformar:
+        recortes = perfil.medir_iterable("composicion", transformar(recortes), imagen=ruta_imagen)
+    
+    paleta = None
+    if args.paleta:
+        with perfil.etapa("paleta", imagen=ruta_imagen):
+            # Con un fondo, o en un nivel reducido, los colores finales no se
+            # conocen hasta generar cada sprite, así que la paleta empieza vacía
+            # y crece con ellos
+            paleta = calcular_paleta(imagen) if es_original and not transformar else Paleta()
+        if paleta is None and detallado:
+            print(f"La hoja tiene más de {MAX_COLORES} colores: los sprites se guardan en RGBA.")
+    
+    with perfil.etapa("escritura", imagen=ruta_imagen):
+        if args.formato == "png":
+            deduplicador = Deduplicador() if args.deduplicar else None
+            filtro = encadenar_filtros(deduplicador, manifiesto.filtro(ruta_imagen) if manifiesto else None, paleta)
+            guardar_sprites(recortes, directorio_salida, args.nombre, detallado, args.en_vuelo,
+                            args.hilos, args.compresion, args.optimizar, filtro)
+            if deduplicador:
+                ruta_indice = deduplicador.guardar_indice(directorio_salida, args.nombre, cajas)
+                if manifiesto:
+                    manifiesto.anotar(ruta_imagen, ruta_indice)
+                if detallado:
+                    print(f"Sprites únicos: {deduplicador.unicos} de {len(cajas)} (índice en {ruta_indice})")
+            if paleta and detallado:
+                print(paleta.resumen())
+        else:
+            atlas.guardar_sprites_atlas(recortes, cajas, directorio_salida, args.nombre, args.formato,
+                                        args.compresion, args.optimizar, detallado)
+            if manifiesto:
+                for ruta_salida in atlas.rutas_atlas(os.path.join(directorio_salida, args.nombre), args.formato):
+                    manifiesto.anotar(ruta_imagen, ruta_salida)
+
+def procesar_hoja_en_lote(ruta_imagen, directorio_salida, args, transformar=None):
+    """
+    Procesa una hoja dentro de un proceso del lote.
+
+    Con --perfil, las etapas se miden en el propio proceso y sus registros se
+    devuelven en el resumen para que el proceso principal los junte.
+    """
+    if not args.perfil:
+        return procesar_hoja(ruta_imagen, directorio_salida, args, False, transformar)
+    
+    perfilador = perfil.Perfilador(formato=None)
+    anterior = perfil.activar(perfilador)
+    try:
+        resumen = procesar_hoja(ruta_imagen, directorio_salida, args, False, transformar)
+    finally:
+        perfil.activar(anterior)
+    resumen["perfil"] = perfilador.registros
+    return resumen
+
+def es_entrada_multiple(entrada):
+    """Indica si una entrada de la línea de comandos es un directorio o un patrón glob."""
+    return os.path.isdir(entrada) or glob.has_magic(entrada)
+
+def expandir_entradas(entradas):
+    """Convierte una lista de archivos, directorios y patrones glob en una lista de rutas de imagen."""
+    rutas = []
+    for entrada in entradas:
+        if os.path.isdir(entrada):
+            archivos = sorted(f for f in os.listdir(entrada) if f.lower().endswith(EXTENSIONES_IMAGEN))
+            rutas.extend(os.path.join(entrada, f) for f in archivos)
+        elif glob.has_magic(entrada):
+            rutas.extend(sorted(r for r in glob.glob(entrada) if os.path.isfile(r)))
+        else:
+            rutas.append(entrada)
+    
+    # Eliminar duplicados manteniendo el orden
+    return list(dict.fromkeys(rutas))
+
+def directorios_por_hoja(rutas, directorio_salida):
+    """Asigna a cada hoja un subdirectorio de salida con su nombre, sin repetir ninguno."""
+    directorios = []
+    usados = set()
+    for ruta in rutas:
+        nombre = os.path.splitext(os.path.basename(ruta))[0]
+        candidato = nombre
+        contador = 2
+        while candidato in usados:
+            candidato = f"{nombre}_{contador}"
+            contador += 1
+        usados.add(candidato)
+        directorios.append(os.path.join(directorio_salida, candidato))
+    return directorios
 
-def guardar_sprites(sprites, directorio_salida, nombre_base):
-    """Guarda los sprites recortados como archivos individuales."""
+def procesar_lote(rutas, directorio_salida, args, procesos=None, transformar=None):
+    """
+    Procesa varias hojas de sprites en paralelo con un grupo de procesos.
+
+    Cada hoja se guarda en su propio subdirectorio y al final se escribe un
+    resumen conjunto en 'resumen.json' dentro del directorio de salida.
+    """
+    # Crear procesos es caro de importar y solo hace falta en los lotes
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    
     os.makedirs(directorio_salida, exist_ok=True)
+    directorios = directorios_por_hoja(rutas, directorio_salida)
+    if args.hilos is None:
+        # Ya hay un proceso por núcleo, así que cada hoja se escribe con un solo hilo
+        args = argparse.Namespace(**{**vars(args), "hilos": 1})
+    resumenes = [None] * len(rutas)
+    inicio = time.perf_counter()
+    
+    with ProcessPoolExecutor(max_workers=procesos) as ejecutor:
+        futuros = {
+            ejecutor.submit(procesar_hoja_en_lote, ruta, directorio, args, transformar): i
+            for i, (ruta, directorio) in enumerate(zip(rutas, directorios))
+        }
+        for futuro in as_completed(futuros):
+            i = futuros[futuro]
+            try:
+                resumen = futuro.result()
+            except Exception as e:
+                resumen = {"imagen": rutas[i], "salida": directorios[i], "sprites": 0, "limites": [], "error": str(e),
+                           "sin_cambios": False}
+            registros = resumen.pop("perfil", [])
+            if perfil.perfilador_activo is not None:
+                for registro in registros:
+                    perfil.perfilador_activo.registrar(registro)
+            resumenes[i] = resumen
+            
+            if resumen["error"]:
+                print(f"Error en {resumen['imagen']}: {resumen['error']}")
+            elif resumen["sin_cambios"]:
+                print(f"Hoja sin cambios: {resumen['imagen']}")
+            else:
+                print(f"Hoja procesada: {resumen['imagen']} -> {resumen['sprites']} sprites en {resumen['salida']}")
+    
+    duracion = time.perf_counter() - inicio
+    total_sprites = sum(r["sprites"] for r in resumenes)
+    errores = sum(1 for r in resumenes if r["error"])
+    
+    with open(os.path.join(directorio_salida, "resumen.json"), "w", encoding="utf-8") as archivo:
+        json.dump({"hojas": resumenes, "total_sprites": total_sprites, "errores": errores,
+                   "segundos": round(duracion, 3)}, archivo, ensure_ascii=False, indent=2)
     
-    for i, sprite in enumerate(sprites):
-        nombre_archivo = f"{nombre_base}_{i+1}.png"
-        ruta_completa = os.path.join(directorio_salida, nombre_archivo)
-        sprite.save(ruta_completa)
-        print(f"Sprite guardado: {ruta_completa}")
+    print(f"Resumen: {len(rutas)} hojas, {total_sprites} sprites, {errores} errores en {duracion:.2f} s.")
+    return resumenes
 
-def main():
+def crear_parser():
+    """Crea el parser de argumentos de la línea de comandos."""
     parser = argparse.ArgumentParser(description="Divide una hoja de sprites en sprites individuales.")
-    parser.add_argument("imagen", help="Ruta de la imagen a procesar")
-    parser.add_argument("--modo", choices=["horizontal", "vertical", "fijo", "auto", "numero"], default="fijo",
-                        help="Modo de división: 'horizontal', 'vertical', 'fijo', 'auto' o 'numero' (predeterminado: fijo)")
+    parser.add_argument("imagen", nargs="+",
+                        help="Ruta de la imagen a procesar. También admite varias rutas, directorios o patrones glob")
+    parser.add_argument("--modo", choices=["horizontal", "vertical", "fijo", "auto", "numero", "componentes"], default="fijo",
+                        help="Modo de división: 'horizontal', 'vertical', 'fijo', 'auto', 'numero' o 'componentes' (predeterminado: fijo)")
     parser.add_argument("--salida", default="sprites_recortados",
                         help="Directorio donde guardar los sprites (predeterminado: 'sprites_recortados')")
     parser.add_argument("--nombre", default="sprite",
@@ -166,50 +698,54 @@ def main():
                         help="Número de sprites horizontalmente (para modo 'numero')")
     parser.add_argument("--num_vertical", type=int, default=0,
                         help="Número de sprites verticalmente (para modo 'numero')")
+    parser.add_argument("--umbral_alpha", type=int, default=0,
+                        help="Valor de alpha a partir del cual un píxel se considera opaco (para modos 'auto', 'horizontal', 'vertical' y 'componentes')")
+    parser.add_argument("--separacion_minima", type=int, default=1,
+                        help="Huecos transparentes más estrechos que este valor no separan sprites (predeterminado: 1)")
+    parser.add_argument("--ancho_minimo", type=int, default=1,
+                        help="Se descartan las bandas más estrechas que este valor (predeterminado: 1)")
+    parser.add_argument("--distancia_union", type=int, default=0,
+                        help="Une regiones separadas por esta distancia o menos en píxeles (para modo 'componentes')")
     
-    args = parser.parse_args()
-    
-    imagen = cargar_imagen(args.imagen)
-    if imagen:
-        if args.modo == "fijo":
-            # Verificar que se proporcionaron ancho y alto
-            if args.ancho <= 0 or args.alto <= 0:
-                print("Error: Para el modo 'fijo', debe proporcionar un ancho y alto válidos (mayores que 0).")
-                return
-                
-            sprites, limites = dividir_sprites_fijos(imagen, args.ancho, args.alto)
-            print(f"Se han generado {len(sprites)} sprites con dimensiones {args.ancho}x{args.alto} píxeles.")
-            for i, limite in enumerate(limites):
-                left, upper, right, lower = limite
-                print(f"Sprite {i+1}: Coordenadas (x1={left}, y1={upper}, x2={right}, y2={lower})")
-        elif args.modo == "auto":
-            sprites, limites = detectar_sprites(imagen)
-            print(f"Se han detectado {len(sprites)} sprites.")
-            for i, limite in enumerate(limites):
-                print(f"Sprite {i+1}: Coordenadas (x1={limite[0]}, y1={limite[1]}, x2={limite[2]}, y2={limite[3]})")
-        elif args.modo == "numero":
-            # Verificar que se proporcionaron num_horizontal y num_vertical
-            if args.num_horizontal <= 0 or args.num_vertical <= 0:
-                print("Error: Para el modo 'numero', debe proporcionar un número válido de sprites horizontal y verticalmente (mayores que 0).")
-                return
-                
-            sprites, limites = detectar_sprites_por_numero(imagen, args.num_horizontal, args.num_vertical)
-            print(f"Se han generado {len(sprites)} sprites con {args.num_horizontal}x{args.num_vertical} divisiones.")
-            for i, limite in enumerate(limites):
-                left, upper, right, lower = limite
-                print(f"Sprite {i+1}: Coordenadas (x1={left}, y1={upper}, x2={right}, y2={lower})")
+    parser.add_argument("--ajustar_recorte", action="store_true",
+                        help="Reduce cada sprite a la caja de sus píxeles opacos, descarta las celdas vacías y "
+                             "guarda los desplazamientos en '<nombre>_ajuste.json'")
+    
+    parser.add_argument("--hoja_grande", action="store_true",
+                        help="Procesa la hoja por bandas a través de una caché RGBA en memoria mapeada, "
+                             "para hojas que no caben en memoria")
+    parser.add_argument("--alto_banda", type=int, default=ALTO_BANDA_PREDETERMINADO,
+                        help="Filas por banda en modo hoja grande (predeterminado: 1024)")
+    parser.add_argument("--cache_bruta", default=None,
+                        help="Directorio de la caché de hojas grandes (predeterminado: directorio temporal del sistema)")
+    parser.add_argument("--procesos", type=int, default=None,
+                        help="Número de procesos para dividir varias hojas a la vez (predeterminado: uno por núcleo)")
+    agregar_opciones_comunes(parser, "carga, detección, recorte, codificación, escritura")
+    return parser
+
+def ejecutar(args, transformar=None):
+    """Divide la hoja o el lote de hojas indicado en los argumentos ya interpretados."""
+    error = validar_argumentos(args)
+    if error:
+        print(error)
+        return
+    
+    rutas = expandir_entradas(args.imagen)
+    if not rutas:
+        print(f"No se encontraron imágenes en: {', '.join(args.imagen)}")
+        return
+    
+    with perfil_de_ejecucion(args):
+        if len(args.imagen) > 1 or es_entrada_multiple(args.imagen[0]):
+            procesar_lote(rutas, args.salida, args, args.procesos, transformar)
+            print("Proceso completado con éxito.")
         else:
-            sprites, limites = recortar_sprites(imagen, args.modo)
-            print(f"Se han detectado {len(sprites)} sprites.")
-            for i, limite in enumerate(limites):
-                if args.modo == "horizontal":
-                    print(f"Sprite {i+1}: Desde x={limite[0]} hasta x={limite[1]}")
-                else:
-                    print(f"Sprite {i+1}: Desde y={limite[0]} hasta y={limite[1]}")
-        
-        guardar_sprites(sprites, args.salida, args.nombre)
-        print("Proceso completado con éxito.")
+            resumen = procesar_hoja(rutas[0], args.salida, args, transformar=transformar)
+            if resumen["error"] is None:
+                print("Proceso completado con éxito.")
+
+def main(argumentos=None):
+    ejecutar(crear_parser().parse_args(argumentos))
 
 if __name__ == "__main__":
     main()
-    
\ No newline at end of file
@@ -0,0 +1,36 @@
+import dividir
+from aplicar_fondo import AplicadorFondo
+
+def crear_parser():
+    """
+    Crea el parser de argumentos: los mismos de dividir.py más el fondo y su ajuste.
+
+    El modo de ajuste se llama --ajuste porque --modo ya es el modo de división.
+    """
+    parser = dividir.crear_parser()
+    parser.description = ("Divide una hoja de sprites y aplica un fondo a cada sprite en una sola pasada, "
+                          "sin archivos intermedios.")
+    parser.set_defaults(salida="sprites_con_fondo")
+    parser.add_argument("--fondo", required=True,
+                        help="Ruta de la imagen de fondo a aplicar a cada sprite")
+    parser.add_argument("--ajuste", choices=["estirar", "centrar", "mosaico", "escalar"], default="estirar",
+                        help="Modo de ajuste del fondo (predeterminado: 'estirar')")
+    parser.add_argument("--motor", choices=["numpy", "pil"], default="numpy",
+                        help="Motor de composición: lotes de NumPy o PIL sprite a sprite (predeterminado: 'numpy')")
+    return parser
+
+def main(argumentos=None):
+    args = crear_parser().parse_args(argumentos)
+    
+    # Se comprueba el fondo antes de empezar para no fallar en cada hoja
+    aplicador = AplicadorFondo(args.fondo, args.ajuste, args.motor)
+    if not aplicador.cargar():
+        return
+    
+    dividir.ejecutar(args, aplicador)
+
+if __name__ == "__main__":
+    main()
+
+# Ejemplo: dividir una hoja de cartas y ponerles fondo sin pasar por disco
+# python dividir_con_fondo.py cartas.png --modo numero --num_horizontal 13 --num_vertical 4 --fondo fondo.png --ajuste escalar --salida cartas_con_fondo
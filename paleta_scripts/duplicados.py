@@ -0,0 +1,57 @@
+import os
+import json
+from incremental import huella_imagen
+
+class Deduplicador:
+    """
+    Filtro para `escritura.escribir_imagenes` que descarta los sprites repetidos.
+
+    Cada sprite se identifica por la huella de sus píxeles: solo se deja pasar
+    la primera aparición, que es el archivo canónico, y las demás celdas se
+    apuntan a ella. Así las celdas vacías o los reversos repetidos se codifican
+    y se guardan una sola vez.
+    """
+
+    def __init__(self):
+        self.canonicos = {}
+        self.archivos = []
+
+    def __call__(self, elementos):
+        for ruta_salida, imagen in elementos:
+            nombre = os.path.basename(ruta_salida)
+            canonico = self.canonicos.setdefault(huella_imagen(imagen), nombre)
+            self.archivos.append(canonico)
+            if canonico == nombre:
+                yield ruta_salida, imagen
+
+    @property
+    def unicos(self):
+        return len(self.canonicos)
+
+    def guardar_indice(self, directorio_salida, nombre_base, limites):
+        """
+        Escribe '<nombre_base>_indice.json', que asigna a cada celda (numerada
+        desde 1) su archivo canónico y sus límites en la hoja. Devuelve la ruta.
+        """
+        celdas = [
+            {"indice": i + 1, "archivo": archivo, "limites": list(limite)}
+            for i, (archivo, limite) in enumerate(zip(self.archivos, limites))
+        ]
+        ruta = os.path.join(directorio_salida, f"{nombre_base}_indice.json")
+        with open(ruta, "w", encoding="utf-8") as archivo:
+            json.dump({"sprites": len(self.archivos), "unicos": self.unicos, "celdas": celdas},
+                      archivo, ensure_ascii=False, indent=2)
+        return ruta
+
+def encadenar_filtros(*filtros):
+    """Combina varios filtros de `escribir_imagenes` en uno, aplicándolos en orden e ignorando los None."""
+    filtros = [filtro for filtro in filtros if filtro]
+    if not filtros:
+        return None
+
+    def filtrar(elementos):
+        for filtro in filtros:
+            elementos = filtro(elementos)
+        return elementos
+
+    return filtrar
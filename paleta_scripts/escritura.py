@@ -0,0 +1,65 @@
+import os
+import threading
+from flujo import procesar_en_flujo
+import perfil
+
+# Nivel de compresión zlib que usa PIL por defecto para PNG
+COMPRESION_PREDETERMINADA = 6
+
+def hilos_predeterminados():
+    """Número de hilos de escritura por defecto: uno por núcleo, como mucho 8."""
+    return min(8, os.cpu_count() or 1)
+
+class Progreso:
+    """Informa del avance de la escritura cada cierto número de archivos en vez de uno a uno."""
+    
+    def __init__(self, descripcion, cada=100, activo=True):
+        self.descripcion = descripcion
+        self.cada = max(1, cada)
+        self.activo = activo
+        self.cuenta = 0
+        self.cerrojo = threading.Lock()
+    
+    def avanzar(self):
+        """Cuenta un archivo más y muestra el avance si se completa un bloque."""
+        with self.cerrojo:
+            self.cuenta += 1
+            if self.activo and self.cuenta % self.cada == 0:
+                print(f"{self.descripcion}: {self.cuenta}")
+    
+    def terminar(self, destino=None):
+        """Muestra el total final."""
+        if self.activo:
+            sufijo = f" en {destino}" if destino else ""
+            print(f"{self.descripcion}: {self.cuenta}{sufijo}")
+
+def guardar_imagen(imagen, ruta, compresion=COMPRESION_PREDETERMINADA, optimizar=False):
+    """
+    Guarda una imagen con las opciones de compresión indicadas.
+    
+    `compresion` (0-9) y `optimizar` solo afectan a PNG: menos compresión escribe
+    más rápido a cambio de archivos más grandes.
+    """
+    imagen.save(ruta, compress_level=compresion, optimize=optimizar)
+
+def escribir_imagenes(elementos, compresion=COMPRESION_PREDETERMINADA, optimizar=False,
+                      hilos=None, en_vuelo=8, progreso=None):
+    """
+    Codifica y escribe pares (ruta, imagen) en un grupo de hilos.
+    
+    La compresión zlib libera el GIL, así que varios hilos codifican a la vez.
+    Con --perfil, la codificación de todos los hilos se mide como la etapa
+    'codificacion'. Devuelve cuántas imágenes se han escrito.
+    """
+    if hilos is None:
+        hilos = hilos_predeterminados()
+    
+    with perfil.etapa_en_hilos("codificacion") as medir:
+        def escribir(elemento):
+            ruta, imagen = elemento
+            with medir():
+                guardar_imagen(imagen, ruta, compresion, optimizar)
+            if progreso:
+                progreso.avanzar()
+        
+        return procesar_en_flujo(elementos, escribir, en_vuelo, hilos)
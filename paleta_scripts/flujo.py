@@ -0,0 +1,51 @@
+import queue
+import threading
+
+def procesar_en_flujo(elementos, consumidor, en_vuelo=8, hilos=1):
+    """
+    Consume los elementos de un iterable en hilos aparte a medida que se generan.
+    
+    Como mucho hay `en_vuelo` elementos generados esperando a ser consumidos, así
+    que la memoria no depende del número total de elementos. Con `hilos` mayor que
+    1 los elementos se consumen en paralelo y sin orden garantizado. Devuelve
+    cuántos elementos se han consumido y relanza el primer error del consumidor.
+    """
+    hilos = max(1, hilos)
+    cola = queue.Queue(maxsize=max(1, en_vuelo))
+    fin = object()
+    errores = []
+    consumidos = [0]
+    cerrojo = threading.Lock()
+    
+    def trabajador():
+        while True:
+            elemento = cola.get()
+            if elemento is fin:
+                return
+            if errores:
+                # Tras un error solo se vacía la cola para no bloquear al productor
+                continue
+            try:
+                consumidor(elemento)
+                with cerrojo:
+                    consumidos[0] += 1
+            except Exception as e:
+                errores.append(e)
+    
+    trabajadores = [threading.Thread(target=trabajador, daemon=True) for _ in range(hilos)]
+    for hilo in trabajadores:
+        hilo.start()
+    try:
+        for elemento in elementos:
+            if errores:
+                break
+            cola.put(elemento)
+    finally:
+        for _ in trabajadores:
+            cola.put(fin)
+        for hilo in trabajadores:
+            hilo.join()
+    
+    if errores:
+        raise errores[0]
+    return consumidos[0]
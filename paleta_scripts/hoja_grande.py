@@ -0,0 +1,278 @@
+import io
+import os
+import glob
+import zlib
+import struct
+import hashlib
+import tempfile
+from contextlib import contextmanager
+from perezoso import importar_perezoso
+from nucleo import tiene_transparencia
+
+Image = importar_perezoso("PIL.Image")
+np = importar_perezoso("numpy")
+
+ALTO_BANDA_PREDETERMINADO = 1024
+
+FIRMA_PNG = b"\x89PNG\r\n\x1a\n"
+
+# Canales de cada tipo de color PNG que se decodifica por bandas (solo 8 bits por canal)
+CANALES_PNG = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+# Bytes de datos filtrados que se descomprimen de una vez al crear la caché
+BYTES_BANDA_DECODIFICACION = 16 * 1024 * 1024
+
+class HojaGrande:
+    """
+    Hoja de sprites respaldada por una caché RGBA sin comprimir en memoria mapeada.
+
+    Se comporta como una imagen de PIL en lo que usan los modos de división
+    (`size`, `width`, `height`, `mode`, `getbands` y `crop`), pero los píxeles
+    solo se leen del disco cuando se recorren las bandas o se recorta un sprite.
+
+    La caché siempre es RGBA, pero `mode` es el modo que tendría la hoja cargada
+    con `nucleo.cargar_imagen` si es RGB o L, y los recortes se devuelven en ese
+    modo (ver `modo_hoja_grande`).
+    """
+
+    def __init__(self, ruta_cache, ancho, alto, alto_banda=ALTO_BANDA_PREDETERMINADO, modo="RGBA"):
+        self.ruta_cache = ruta_cache
+        self.alto_banda = max(1, alto_banda)
+        self.mode = modo
+        self.datos = np.memmap(ruta_cache, dtype=np.uint8, mode="r", shape=(alto, ancho, 4))
+
+    @property
+    def size(self):
+        return self.datos.shape[1], self.datos.shape[0]
+
+    @property
+    def width(self):
+        return self.datos.shape[1]
+
+    @property
+    def height(self):
+        return self.datos.shape[0]
+
+    def getbands(self):
+        return tuple(self.mode)
+
+    def bandas(self):
+        """Genera (y_inicio, banda) recorriendo la hoja en bandas horizontales de `alto_banda` filas."""
+        for y in range(0, self.height, self.alto_banda):
+            yield y, self.datos[y:y + self.alto_banda]
+
+    def crop(self, caja):
+        """Recorta la caja (x1, y1, x2, y2) leyendo solo sus píxeles; fuera de la hoja queda transparente."""
+        x1, y1, x2, y2 = caja
+        recorte = np.zeros((max(0, y2 - y1), max(0, x2 - x1), 4), dtype=np.uint8)
+        xa, ya = max(x1, 0), max(y1, 0)
+        xb, yb = min(x2, self.width), min(y2, self.height)
+        if xa < xb and ya < yb:
+            recorte[ya - y1:yb - y1, xa - x1:xb - x1] = self.datos[ya:yb, xa:xb]
+        imagen = Image.fromarray(recorte, "RGBA")
+        return imagen if self.mode == "RGBA" else imagen.convert(self.mode)
+
+def modo_hoja_grande(imagen):
+    """
+    Modo de los recortes de una hoja grande a partir de la imagen original.
+
+    Las hojas RGB y L sin transparencia conservan su modo, como con
+    `nucleo.cargar_imagen`, y la conversión desde la caché RGBA es exacta. Las
+    demás se tratan como RGBA: las de paleta sin transparencia, por ejemplo,
+    dan recortes RGBA en lugar de recortes con paleta.
+    """
+    if imagen.mode in ("RGB", "L") and not tiene_transparencia(imagen):
+        return imagen.mode
+    return "RGBA"
+
+def ruta_cache_bruta(ruta_imagen, directorio_cache):
+    """
+    Ruta de la caché de una imagen: '<nombre>-<origen>-<versión>.rgba'.
+
+    <origen> identifica la ruta del archivo y <versión> cambia si cambia su
+    tamaño o su fecha, así que las versiones anteriores de una misma imagen se
+    pueden localizar y borrar.
+    """
+    ruta = os.path.abspath(ruta_imagen)
+    estado = os.stat(ruta)
+    origen = hashlib.sha1(ruta.encode("utf-8")).hexdigest()[:12]
+    version = hashlib.sha1(f"{estado.st_size}|{estado.st_mtime_ns}".encode("utf-8")).hexdigest()[:12]
+    nombre = os.path.splitext(os.path.basename(ruta_imagen))[0]
+    return os.path.join(directorio_cache, f"{nombre}-{origen}-{version}.rgba")
+
+def eliminar_caches_anteriores(ruta_cache):
+    """Borra las cachés de versiones anteriores de la misma imagen de origen."""
+    prefijo = ruta_cache.rsplit("-", 1)[0]
+    for ruta in glob.glob(glob.escape(prefijo) + "-*.rgba"):
+        if ruta != ruta_cache:
+            try:
+                os.remove(ruta)
+            except OSError:
+                # Otro proceso puede tenerla abierta; se volverá a intentar la próxima vez
+                pass
+
+@contextmanager
+def sin_limite_de_pixeles():
+    """Desactiva temporalmente el límite de PIL contra bombas de descompresión, que las hojas grandes superan."""
+    limite_anterior = Image.MAX_IMAGE_PIXELS
+    Image.MAX_IMAGE_PIXELS = None
+    try:
+        yield
+    finally:
+        Image.MAX_IMAGE_PIXELS = limite_anterior
+
+def fragmento_png(tipo, datos):
+    """Serializa un fragmento PNG con su longitud y su CRC."""
+    crc = zlib.crc32(datos, zlib.crc32(tipo))
+    return struct.pack(">I", len(datos)) + tipo + datos + struct.pack(">I", crc)
+
+def leer_fragmento_png(archivo):
+    """Lee el siguiente fragmento de un PNG; devuelve (tipo, datos) o (None, b"") al final del archivo."""
+    cabecera = archivo.read(8)
+    if len(cabecera) < 8:
+        return None, b""
+    largo, tipo = struct.unpack(">I4s", cabecera)
+    datos = archivo.read(largo)
+    archivo.read(4)  # CRC, PIL lo comprueba al decodificar cada banda
+    return tipo, datos
+
+def bandas_png(ruta_imagen):
+    """
+    Prepara la decodificación de un PNG por bandas sin tenerlo nunca entero en memoria.
+
+    Devuelve un generador de imágenes de PIL con bandas horizontales consecutivas,
+    o None si el archivo no es un PNG de 8 bits por canal sin entrelazar, que son
+    los únicos cuyas filas se pueden reconstruir banda a banda.
+    """
+    archivo = open(ruta_imagen, "rb")
+    try:
+        if archivo.read(8) != FIRMA_PNG:
+            archivo.close()
+            return None
+        tipo, ihdr = leer_fragmento_png(archivo)
+        if tipo != b"IHDR":
+            archivo.close()
+            return None
+        ancho, alto, profundidad, tipo_color, _, _, entrelazado = struct.unpack(">IIBBBBB", ihdr)
+        if profundidad != 8 or entrelazado or tipo_color not in CANALES_PNG:
+            archivo.close()
+            return None
+
+        # La paleta y el color transparente se copian a cada banda
+        auxiliares = []
+        while True:
+            tipo, datos = leer_fragmento_png(archivo)
+            if tipo is None or tipo == b"IEND":
+                archivo.close()
+                return None
+            if tipo == b"IDAT":
+                break
+            if tipo in (b"PLTE", b"tRNS"):
+                auxiliares.append(fragmento_png(tipo, datos))
+    except Exception:
+        archivo.close()
+        raise
+
+    return generar_bandas_png(archivo, datos, ancho, alto, tipo_color, auxiliares)
+
+def generar_bandas_png(archivo, primer_idat, ancho, alto, tipo_color, auxiliares):
+    """
+    Descomprime los fragmentos IDAT poco a poco y decodifica las filas por bandas.
+
+    Los filtros de PNG dependen de la fila anterior, así que cada banda se
+    envuelve en un PNG propio sin comprimir cuya primera fila es la última de la
+    banda anterior ya decodificada (con filtro 0), y PIL deshace los filtros.
+    """
+    bytes_fila = 1 + ancho * CANALES_PNG[tipo_color]
+    filas_banda = max(1, BYTES_BANDA_DECODIFICACION // bytes_fila)
+    descompresor = zlib.decompressobj()
+    pendiente = bytearray()
+    comprimido = primer_idat
+    anterior = None
+
+    with archivo:
+        for y in range(0, alto, filas_banda):
+            filas = min(filas_banda, alto - y)
+            necesarios = filas * bytes_fila
+            while len(pendiente) < necesarios:
+                if not comprimido:
+                    tipo, comprimido = leer_fragmento_png(archivo)
+                    if tipo != b"IDAT":
+                        raise ValueError("el PNG está truncado")
+                    continue
+                pendiente += descompresor.decompress(comprimido, necesarios - len(pendiente))
+                comprimido = descompresor.unconsumed_tail
+            filtradas = bytes(pendiente[:necesarios])
+            del pendiente[:necesarios]
+
+            contexto = b"" if anterior is None else b"\x00" + anterior
+            total = filas + (anterior is not None)
+            ihdr = struct.pack(">IIBBBBB", ancho, total, 8, tipo_color, 0, 0, 0)
+            idat = zlib.compress(contexto + filtradas, 0)
+            del filtradas
+            png = b"".join([FIRMA_PNG, fragmento_png(b"IHDR", ihdr), *auxiliares,
+                            fragmento_png(b"IDAT", idat), fragmento_png(b"IEND", b"")])
+            del idat
+            banda = Image.open(io.BytesIO(png))
+            banda.load()
+            del png
+            if anterior is not None:
+                banda = banda.crop((0, 1, ancho, total))
+            anterior = banda.crop((0, filas - 1, ancho, filas)).tobytes()
+            yield banda
+
+def bandas_decodificadas(ruta_imagen, alto_banda):
+    """Genera la imagen en bandas horizontales consecutivas, decodificándola por bandas si es posible."""
+    bandas = bandas_png(ruta_imagen)
+    if bandas is not None:
+        yield from bandas
+        return
+
+    # Otros formatos, y los PNG entrelazados o de 1, 2, 4 o 16 bits: PIL los decodifica enteros
+    with Image.open(ruta_imagen) as imagen:
+        for y in range(0, imagen.height, alto_banda):
+            yield imagen.crop((0, y, imagen.width, min(imagen.height, y + alto_banda)))
+
+def crear_cache_bruta(ruta_imagen, ruta_cache, alto_banda=ALTO_BANDA_PREDETERMINADO):
+    """
+    Decodifica una imagen y vuelca sus píxeles RGBA a `ruta_cache` banda a banda.
+
+    Los PNG de 8 bits sin entrelazar, que son casi todas las hojas de sprites, se
+    descomprimen por bandas y nunca están enteros en memoria; los demás formatos
+    se decodifican una vez enteros en su modo original. La caché se escribe con
+    escrituras normales y no con un mapa de memoria, para que sus páginas no
+    cuenten como memoria del proceso. Al terminar se borran las cachés de
+    versiones anteriores de la misma imagen.
+    """
+    temporal = ruta_cache + ".tmp"
+    with sin_limite_de_pixeles(), open(temporal, "wb") as destino:
+        for banda in bandas_decodificadas(ruta_imagen, alto_banda):
+            if banda.mode != "RGBA":
+                banda = banda.convert("RGBA")
+            destino.write(banda.tobytes())
+
+    os.replace(temporal, ruta_cache)
+    eliminar_caches_anteriores(ruta_cache)
+
+def cargar_hoja_grande(ruta_imagen, directorio_cache=None, alto_banda=ALTO_BANDA_PREDETERMINADO):
+    """
+    Abre una hoja grande a través de su caché bruta, creándola si no existe.
+
+    La caché se reutiliza en ejecuciones posteriores mientras la imagen no cambie.
+    """
+    try:
+        if directorio_cache is None:
+            directorio_cache = os.path.join(tempfile.gettempdir(), "paleta_scripts")
+        os.makedirs(directorio_cache, exist_ok=True)
+        ruta_cache = ruta_cache_bruta(ruta_imagen, directorio_cache)
+
+        # Solo se lee la cabecera para conocer el tamaño y el modo
+        with sin_limite_de_pixeles(), Image.open(ruta_imagen) as imagen:
+            ancho, alto = imagen.size
+            modo = modo_hoja_grande(imagen)
+        if not os.path.exists(ruta_cache) or os.path.getsize(ruta_cache) != ancho * alto * 4:
+            crear_cache_bruta(ruta_imagen, ruta_cache, alto_banda)
+        return HojaGrande(ruta_cache, ancho, alto, alto_banda, modo)
+    except Exception as e:
+        print(f"Error al cargar la imagen: {e}")
+        return None
@@ -0,0 +1,155 @@
+import os
+import json
+import hashlib
+
+NOMBRE_MANIFIESTO = ".manifiesto.json"
+
+def huella_archivo(ruta):
+    """Huella del contenido de un archivo."""
+    resumen = hashlib.blake2b(digest_size=16)
+    with open(ruta, "rb") as archivo:
+        for bloque in iter(lambda: archivo.read(1 << 20), b""):
+            resumen.update(bloque)
+    return resumen.hexdigest()
+
+def huella_imagen(imagen):
+    """Huella de los píxeles de una imagen, incluidos su modo y tamaño."""
+    resumen = hashlib.blake2b(digest_size=16)
+    resumen.update(f"{imagen.mode}|{imagen.size}".encode("utf-8"))
+    resumen.update(imagen.tobytes())
+    return resumen.hexdigest()
+
+def calcular_clave(rutas_entrada, parametros):
+    """
+    Clave de una hoja: huella de sus archivos de entrada (hoja y fondo) y de los
+    parámetros que afectan a la salida.
+    """
+    resumen = hashlib.blake2b(digest_size=16)
+    for ruta in rutas_entrada:
+        resumen.update(huella_archivo(ruta).encode("utf-8"))
+    resumen.update(json.dumps(parametros, sort_keys=True, default=str).encode("utf-8"))
+    return resumen.hexdigest()
+
+class Manifiesto:
+    """
+    Manifiesto de un directorio de salida para el procesado incremental.
+
+    Guarda, por cada hoja de entrada, su clave y la huella de píxeles de cada
+    archivo generado. Las hojas cuya clave no cambia se omiten por completo; en
+    las que cambian solo se reescriben los sprites cuya huella es distinta, y los
+    archivos que ya no se generan se eliminan.
+    """
+
+    def __init__(self, directorio_salida):
+        self.directorio = directorio_salida
+        self.ruta = os.path.join(directorio_salida, NOMBRE_MANIFIESTO)
+        self.hojas = {}
+        self.en_curso = {}
+        if os.path.exists(self.ruta):
+            try:
+                with open(self.ruta, encoding="utf-8") as archivo:
+                    self.hojas = json.load(archivo).get("hojas", {})
+            except (OSError, ValueError):
+                # Un manifiesto dañado equivale a no tener ninguno: se reprocesa todo
+                self.hojas = {}
+
+    @staticmethod
+    def identificador(ruta_imagen):
+        return os.path.abspath(ruta_imagen)
+
+    def sin_cambios(self, ruta_imagen, clave):
+        """Devuelve la entrada guardada si la hoja no ha cambiado y sus salidas siguen en disco, o None."""
+        entrada = self.hojas.get(self.identificador(ruta_imagen))
+        if not entrada or entrada["clave"] != clave:
+            return None
+        for nombre in entrada["salidas"]:
+            if not os.path.exists(os.path.join(self.directorio, nombre)):
+                return None
+        return entrada
+
+    def iniciar_hoja(self, ruta_imagen, codificacion=None):
+        """
+        Empieza a registrar las salidas de una hoja.
+
+        `codificacion` resume las opciones que cambian los bytes pero no los
+        píxeles que se comparan (compresión, optimización, PNG indexado); si
+        cambia, se reescribe todo.
+        """
+        identificador = self.identificador(ruta_imagen)
+        entrada = self.hojas.get(identificador, {})
+        anteriores = entrada.get("salidas", {}) if entrada.get("codificacion") == codificacion else {}
+        self.en_curso[identificador] = {"salidas": {}, "anteriores": anteriores, "omitidos": 0,
+                                        "codificacion": codificacion}
+
+    def filtro(self, ruta_imagen):
+        """
+        Devuelve un filtro para `escritura.escribir_imagenes`.
+
+        El filtro anota la huella de cada (ruta, imagen) y solo deja pasar las
+        imágenes que han cambiado desde la ejecución anterior.
+        """
+        estado = self.en_curso[self.identificador(ruta_imagen)]
+        anteriores = estado["anteriores"]
+
+        def filtrar(elementos):
+            for ruta_salida, imagen in elementos:
+                nombre = self.nombre_salida(ruta_salida)
+                huella = huella_imagen(imagen)
+                estado["salidas"][nombre] = huella
+                if anteriores.get(nombre) == huella and os.path.exists(ruta_salida):
+                    estado["omitidos"] += 1
+                    continue
+                yield ruta_salida, imagen
+
+        return filtrar
+
+    def nombre_salida(self, ruta_salida):
+        """Nombre de una salida relativo al directorio, que puede incluir subdirectorios como '0.5x'."""
+        return os.path.relpath(ruta_salida, self.directorio)
+
+    def ruta_dentro(self, nombre):
+        """
+        Ruta real de una salida del manifiesto, o None si el nombre es absoluto o
+        sale del directorio (un manifiesto editado no puede borrar nada fuera).
+        """
+        if os.path.isabs(nombre):
+            return None
+        directorio = os.path.realpath(self.directorio)
+        ruta = os.path.realpath(os.path.join(directorio, nombre))
+        if os.path.commonpath([directorio, ruta]) != directorio or ruta == directorio:
+            return None
+        return ruta
+
+    def anotar(self, ruta_imagen, ruta_salida):
+        """Registra una salida que se escribe siempre, como un atlas."""
+        self.en_curso[self.identificador(ruta_imagen)]["salidas"][self.nombre_salida(ruta_salida)] = None
+
+    def cerrar_hoja(self, ruta_imagen, clave, **datos):
+        """
+        Elimina las salidas antiguas que ya no se generan y guarda la entrada de la hoja.
+
+        Devuelve (sprites sin cambios, archivos eliminados).
+        """
+        identificador = self.identificador(ruta_imagen)
+        estado = self.en_curso.pop(identificador)
+        anteriores = self.hojas.get(identificador, {}).get("salidas", {})
+
+        eliminados = 0
+        for nombre in anteriores:
+            if nombre not in estado["salidas"]:
+                ruta_antigua = self.ruta_dentro(nombre)
+                if ruta_antigua and os.path.isfile(ruta_antigua):
+                    os.remove(ruta_antigua)
+                    eliminados += 1
+
+        self.hojas[identificador] = {"clave": clave, "codificacion": estado["codificacion"],
+                                     "salidas": estado["salidas"], **datos}
+        return estado["omitidos"], eliminados
+
+    def guardar(self):
+        """Escribe el manifiesto de forma atómica."""
+        os.makedirs(self.directorio, exist_ok=True)
+        temporal = self.ruta + ".tmp"
+        with open(temporal, "w", encoding="utf-8") as archivo:
+            json.dump({"hojas": self.hojas}, archivo, ensure_ascii=False)
+        os.replace(temporal, self.ruta)
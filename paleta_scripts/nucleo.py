@@ -0,0 +1,128 @@
+from contextlib import contextmanager
+from escritura import COMPRESION_PREDETERMINADA
+from perezoso import importar_perezoso
+from piramide import validar_escalas
+import perfil
+
+Image = importar_perezoso("PIL.Image")
+
+EXTENSIONES_IMAGEN = ('.png', '.jpg', '.jpeg', '.gif')
+
+def tiene_transparencia(imagen):
+    """Indica si la imagen tiene canal alpha o un color transparente (fragmento tRNS de PNG o GIF)."""
+    return "A" in imagen.getbands() or "transparency" in imagen.info
+
+def cargar_imagen(ruta_imagen):
+    """
+    Carga una imagen desde una ruta especificada.
+
+    Las imágenes con transparencia se convierten a RGBA, también las que la
+    indican con un color transparente, para que la detección la vea; las demás
+    se dejan en su modo.
+    """
+    try:
+        imagen = Image.open(ruta_imagen)
+        if imagen.mode != "RGBA" and tiene_transparencia(imagen):
+            imagen = imagen.convert("RGBA")
+        return imagen
+    except Exception as e:
+        print(f"Error al cargar la imagen: {e}")
+        return None
+
+def iterar_recortes(imagen, limites):
+    """Genera los recortes de la imagen de uno en uno, sin tenerlos todos en memoria."""
+    for limite in limites:
+        yield imagen.crop(limite)
+
+def detectar_sprites_por_numero(imagen, num_horizontal, num_vertical):
+    """Detecta los límites de cada sprite en una imagen basado en el número de sprites horizontal y verticalmente."""
+    limites = limites_por_numero(imagen.size, num_horizontal, num_vertical)
+    return list(iterar_recortes(imagen, limites)), limites
+
+def limites_por_numero(tamaño_imagen, num_horizontal, num_vertical):
+    """Calcula los límites de una cuadrícula de num_horizontal x num_vertical sprites."""
+    imagen_ancho, imagen_alto = tamaño_imagen
+    ancho_sprite = imagen_ancho // num_horizontal
+    alto_sprite = imagen_alto // num_vertical
+    
+    limites = []
+    
+    for y in range(num_vertical):
+        for x in range(num_horizontal):
+            left = x * ancho_sprite
+            upper = y * alto_sprite
+            right = left + ancho_sprite
+            lower = upper + alto_sprite
+            
+            limites.append((left, upper, right, lower))
+    
+    return limites
+
+def agregar_opciones_comunes(parser, etapas, **ayudas):
+    """
+    Añade las opciones de salida, concurrencia y perfil comunes a dividir.py y aplicar_fondo.py.
+
+    `etapas` son las etapas que mide --perfil. `ayudas` sustituye la ayuda de
+    --formato, --paleta o --deduplicar, que cambian de una herramienta a otra.
+    """
+    parser.add_argument("--formato", choices=["png", "atlas", "bruto"], default="png",
+                        help=ayudas.get("formato",
+                                        "Salida: un PNG por sprite, un atlas PNG empaquetado o un bloque RGBA bruto, "
+                                        "ambos con un índice binario '<nombre>.idx' (predeterminado: 'png')"))
+    parser.add_argument("--paleta", action="store_true",
+                        help=ayudas.get("paleta",
+                                        "Guarda PNG indexados con una paleta común a toda la hoja, o en RGBA si la "
+                                        "hoja tiene más de 256 colores (solo con --formato png)"))
+    parser.add_argument("--deduplicar", action="store_true",
+                        help=ayudas.get("deduplicar",
+                                        "Guarda una sola vez los sprites con píxeles idénticos y escribe "
+                                        "'<nombre>_indice.json' con el archivo de cada celda (solo con --formato png)"))
+    parser.add_argument("--escalas", type=float, nargs="+", default=None,
+                        help="Guarda también la salida a estas escalas (entre 0 y 1), cada una en un "
+                             "subdirectorio como '0.5x', a partir de una sola decodificación de cada imagen")
+    parser.add_argument("--en_vuelo", type=int, default=8,
+                        help="Máximo de sprites pendientes de escribir (predeterminado: 8)")
+    parser.add_argument("--hilos", type=int, default=None,
+                        help="Hilos para codificar y escribir los PNG (predeterminado: uno por núcleo, hasta 8)")
+    parser.add_argument("--compresion", type=int, choices=range(10), default=COMPRESION_PREDETERMINADA,
+                        metavar="0-9",
+                        help="Nivel de compresión PNG: menor es más rápido y ocupa más (predeterminado: 6)")
+    parser.add_argument("--optimizar", action="store_true",
+                        help="Optimiza los PNG para ocupar menos a cambio de más tiempo de escritura")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Omite las imágenes que no han cambiado desde la última ejecución y solo reescribe "
+                             "los archivos distintos, según el manifiesto '.manifiesto.json' de la salida")
+    parser.add_argument("--perfil", nargs="?", const="tabla", choices=["tabla", "json"], default=None,
+                        help=f"Mide cada etapa ({etapas}) y muestra una tabla o un registro JSON por línea "
+                             "(predeterminado: 'tabla')")
+    parser.add_argument("--perfil_salida", default=None,
+                        help="Archivo donde añadir los registros JSON de --perfil json (predeterminado: la consola)")
+    parser.add_argument("--perfil_cprofile", default=None,
+                        help="Guarda en este archivo el cProfile de la etapa más lenta")
+
+def validar_opciones_comunes(args):
+    """Comprueba las opciones de `agregar_opciones_comunes`. Devuelve un mensaje de error o None."""
+    if args.paleta and args.formato != "png":
+        return "Error: --paleta solo puede usarse con --formato png."
+    if args.deduplicar and args.formato != "png":
+        return "Error: --deduplicar solo puede usarse con --formato png."
+    return validar_escalas(args.escalas)
+
+@contextmanager
+def perfil_de_ejecucion(args):
+    """
+    Activa el perfilador pedido con --perfil mientras dura una ejecución y
+    muestra su resumen si termina bien.
+
+    Al salir deja activo el perfilador que hubiera antes, para poder encadenar
+    ejecuciones en un mismo proceso.
+    """
+    anterior = perfil.perfilador_activo
+    if args.perfil:
+        perfil.activar(perfil.Perfilador(args.perfil, args.perfil_salida, args.perfil_cprofile))
+    try:
+        yield
+        if perfil.perfilador_activo is not None:
+            perfil.perfilador_activo.mostrar_resumen()
+    finally:
+        perfil.activar(anterior)
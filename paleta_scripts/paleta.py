@@ -0,0 +1,117 @@
+from perezoso import importar_perezoso
+
+Image = importar_perezoso("PIL.Image")
+np = importar_perezoso("numpy")
+
+MAX_COLORES = 256
+
+def empaquetar_colores(datos):
+    """
+    Convierte un array H×W×4 RGBA en un array H×W de enteros de 32 bits, un color por píxel.
+
+    Los píxeles completamente transparentes se unifican en el valor 0, ya que
+    su color no se ve, para que no ocupen entradas de la paleta.
+    """
+    valores = np.ascontiguousarray(datos).view("<u4")[..., 0]
+    return np.where(datos[..., 3] == 0, np.uint32(0), valores)
+
+def colores_de_hoja(imagen, max_colores=MAX_COLORES):
+    """
+    Devuelve los colores distintos de una hoja (ordenados y empaquetados), o
+    None si hay más de `max_colores`.
+
+    Las hojas grandes (con `bandas()`, ver `hoja_grande.HojaGrande`) se recorren
+    banda a banda y se dejan de recorrer en cuanto se supera el límite.
+    """
+    if hasattr(imagen, "bandas"):
+        bandas = (banda for _, banda in imagen.bandas())
+    else:
+        bandas = [np.asarray(imagen.convert("RGBA"))]
+
+    colores = np.zeros(0, dtype="<u4")
+    for banda in bandas:
+        colores = np.union1d(colores, np.unique(empaquetar_colores(banda)))
+        if len(colores) > max_colores:
+            return None
+    return colores
+
+class Paleta:
+    """
+    Paleta compartida por todos los sprites de una hoja, para guardarlos como PNG indexados.
+
+    Puede crearse con los colores de la hoja (`calcular_paleta`), o vacía para
+    que crezca con los colores de cada sprite que se cuantiza, como cuando se
+    aplica un fondo y los colores finales no se conocen de antemano. Un sprite
+    cuyos colores ya no caben se deja en RGBA.
+
+    Se usa como filtro de `escritura.escribir_imagenes`: recibe pares (ruta,
+    imagen) y genera los mismos pares con la imagen indexada.
+    """
+
+    def __init__(self, colores=None, max_colores=MAX_COLORES):
+        self.max_colores = max_colores
+        self.colores = np.zeros(0, dtype="<u4") if colores is None else np.asarray(colores, dtype="<u4")
+        self.indexados = 0
+        self.rgba = 0
+        self.ordenar()
+
+    def ordenar(self):
+        # Los colores se guardan en orden de llegada, para que los índices ya
+        # usados no cambien al añadir más, y se buscan por su orden numérico
+        self.orden = np.argsort(self.colores, kind="stable")
+        self.ordenados = self.colores[self.orden]
+
+    def buscar(self, valores):
+        """Devuelve el índice en la paleta de cada valor y una máscara de los que están."""
+        if len(self.colores) == 0:
+            return np.zeros(valores.shape, dtype=np.intp), np.zeros(valores.shape, dtype=bool)
+        posiciones = np.minimum(np.searchsorted(self.ordenados, valores), len(self.colores) - 1)
+        return self.orden[posiciones], self.ordenados[posiciones] == valores
+
+    def cuantizar(self, imagen):
+        """Devuelve la imagen en modo 'P' con esta paleta, o None si sus colores no caben."""
+        if imagen.width == 0 or imagen.height == 0:
+            return None
+        datos = np.asarray(imagen.convert("RGBA"))
+        valores = empaquetar_colores(datos)
+        indices, encontrados = self.buscar(valores)
+
+        if not encontrados.all():
+            nuevos = np.unique(valores[~encontrados])
+            if len(self.colores) + len(nuevos) > self.max_colores:
+                return None
+            self.colores = np.concatenate([self.colores, nuevos])
+            self.ordenar()
+            indices, _ = self.buscar(valores)
+
+        indexada = Image.fromarray(indices.astype(np.uint8), "P")
+        rgba = self.colores.view(np.uint8).reshape(-1, 4)
+        indexada.putpalette(rgba[:, :3].tobytes(), "RGB")
+        if (rgba[:, 3] < 255).any():
+            # Canal alpha de cada entrada de la paleta (fragmento tRNS del PNG)
+            indexada.info["transparency"] = rgba[:, 3].tobytes()
+        return indexada
+
+    def __call__(self, elementos):
+        for ruta, imagen in elementos:
+            indexada = self.cuantizar(imagen)
+            if indexada is None:
+                self.rgba += 1
+                yield ruta, imagen
+            else:
+                self.indexados += 1
+                yield ruta, indexada
+
+    def resumen(self):
+        """Texto con el tamaño de la paleta y cuántos sprites se han indexado."""
+        texto = f"Paleta: {len(self.colores)} colores, {self.indexados} sprites indexados"
+        if self.rgba:
+            texto += f", {self.rgba} en RGBA por superar {self.max_colores} colores"
+        return texto
+
+def calcular_paleta(imagen, max_colores=MAX_COLORES):
+    """Calcula la paleta de una hoja, o devuelve None si tiene más de `max_colores` colores."""
+    colores = colores_de_hoja(imagen, max_colores)
+    if colores is None:
+        return None
+    return Paleta(colores, max_colores)
@@ -0,0 +1,25 @@
+import sys
+import importlib.util
+
+def importar_perezoso(nombre):
+    """
+    Importa un módulo sin ejecutarlo hasta que se usa alguno de sus atributos.
+
+    Así `--help` y las herramientas que no llegan a tocar NumPy o PIL no pagan
+    lo que cuesta importarlos. Si el módulo ya estaba importado se devuelve tal cual.
+    """
+    if nombre in sys.modules:
+        return sys.modules[nombre]
+    especificacion = importlib.util.find_spec(nombre)
+    if especificacion is None:
+        raise ModuleNotFoundError(f"No se encontró el módulo '{nombre}'", name=nombre)
+    cargador = importlib.util.LazyLoader(especificacion.loader)
+    especificacion.loader = cargador
+    modulo = importlib.util.module_from_spec(especificacion)
+    sys.modules[nombre] = modulo
+    if "." in nombre:
+        # Como en una importación normal, el submódulo queda como atributo del paquete
+        paquete, _, submodulo = nombre.rpartition(".")
+        setattr(sys.modules[paquete], submodulo, modulo)
+    cargador.exec_module(modulo)
+    return modulo
@@ -0,0 +1,285 @@
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager, nullcontext
+from perezoso import importar_perezoso
+
+pstats = importar_perezoso("pstats")
+cProfile = importar_perezoso("cProfile")
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+def memoria_pico_mb():
+    """Memoria residente máxima del proceso en MB (0 si el sistema no la ofrece)."""
+    if resource is None:
+        return 0.0
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS lo da en bytes y Linux en KiB
+    return pico / (1024 * 1024) if sys.platform == "darwin" else pico / 1024
+
+def leer_io():
+    """Bytes leídos y escritos por el proceso hasta ahora, según /proc/self/io (0 si no existe)."""
+    try:
+        with open("/proc/self/io") as archivo:
+            campos = dict(linea.split(":") for linea in archivo if ":" in linea)
+        return int(campos["rchar"]), int(campos["wchar"])
+    except (OSError, KeyError, ValueError):
+        return 0, 0
+
+class Perfilador:
+    """
+    Mide cada etapa del proceso: tiempo real, tiempo de CPU, bytes leídos y
+    escritos y memoria máxima.
+
+    - formato 'json': emite un registro JSON por línea al terminar cada etapa
+    - formato 'tabla': muestra un resumen por etapa con `mostrar_resumen`
+    - formato None: solo guarda los registros y avisa a los `oyentes`
+
+    Los tiempos de cada etapa son exclusivos: si dentro de una etapa se consume
+    un generador medido aparte (por ejemplo, los recortes que se generan
+    mientras se escribe), ese tiempo se cuenta solo en la etapa del generador.
+    El trabajo repartido entre hilos se mide con `etapa_en_hilos`, sumando el
+    de todos ellos. Los bytes leídos y escritos son los de todo el proceso
+    durante la etapa.
+
+    Con `ruta_cprofile` se perfila cada etapa con cProfile, también en los hilos
+    de `etapa_en_hilos`, y al final se guardan las estadísticas de la etapa que
+    más tiempo ha consumido.
+    """
+
+    def __init__(self, formato="tabla", salida=None, ruta_cprofile=None, oyentes=None):
+        self.formato = formato
+        self.salida = salida
+        self.ruta_cprofile = ruta_cprofile
+        self.oyentes = list(oyentes or [])
+        self.registros = []
+        # Perfiles de cProfile por etapa, uno por cada hilo que la ha ejecutado
+        self.perfiles = {}
+        self.cerrojo = threading.Lock()
+        self.local = threading.local()
+
+    def pila(self):
+        """Mediciones abiertas en el hilo actual, de la más externa a la más interna."""
+        if not hasattr(self.local, "pila"):
+            self.local.pila = []
+            self.local.perfiles = {}
+        return self.local.pila
+
+    def perfil_del_hilo(self, nombre):
+        """Devuelve el perfil de cProfile de la etapa en el hilo actual, o None sin `ruta_cprofile`."""
+        if not self.ruta_cprofile:
+            return None
+        perfil = self.local.perfiles.get(nombre)
+        if perfil is None:
+            perfil = self.local.perfiles[nombre] = cProfile.Profile()
+            with self.cerrojo:
+                self.perfiles.setdefault(nombre, []).append(perfil)
+        return perfil
+
+    @contextmanager
+    def medir(self, nombre):
+        """
+        Mide el bloque en el hilo actual y genera un diccionario que, al salir,
+        contiene su tiempo real y de CPU exclusivos en "pared" y "cpu".
+
+        Las mediciones anidadas se restan de la que las contiene, y cProfile
+        solo perfila la más interna.
+        """
+        pila = self.pila()
+        padre = pila[-1] if pila else None
+        marco = {"pared": 0.0, "cpu": 0.0, "hijos_pared": 0.0, "hijos_cpu": 0.0,
+                 "perfil": self.perfil_del_hilo(nombre)}
+        if padre and padre["perfil"]:
+            padre["perfil"].disable()
+        if marco["perfil"]:
+            try:
+                marco["perfil"].enable()
+            except ValueError:
+                # Desde Python 3.12 solo puede haber un perfilador activo en
+                # todo el proceso; si otro hilo lo tiene, este bloque no se perfila
+                marco["perfil"] = None
+        pila.append(marco)
+        inicio_pared, inicio_cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield marco
+        finally:
+            pared = time.perf_counter() - inicio_pared
+            cpu = time.thread_time() - inicio_cpu
+            pila.pop()
+            if marco["perfil"]:
+                marco["perfil"].disable()
+            if padre:
+                padre["hijos_pared"] += pared
+                padre["hijos_cpu"] += cpu
+                if padre["perfil"]:
+                    try:
+                        padre["perfil"].enable()
+                    except ValueError:
+                        padre["perfil"] = None
+            marco["pared"] = pared - marco["hijos_pared"]
+            marco["cpu"] = cpu - marco["hijos_cpu"]
+
+    @contextmanager
+    def etapa(self, nombre, **datos):
+        """Mide el bloque de código como una etapa llamada `nombre`."""
+        leidos, escritos = leer_io()
+        marco = None
+        try:
+            with self.medir(nombre) as marco:
+                yield
+        finally:
+            leidos_fin, escritos_fin = leer_io()
+            self.registrar({
+                "etapa": nombre,
+                **datos,
+                "pared_s": marco["pared"] if marco else 0.0,
+                "cpu_s": marco["cpu"] if marco else 0.0,
+                "bytes_leidos": leidos_fin - leidos,
+                "bytes_escritos": escritos_fin - escritos,
+                "memoria_pico_mb": memoria_pico_mb(),
+            })
+
+    def medir_iterable(self, nombre, iterable, **datos):
+        """
+        Mide como etapa el tiempo que se pasa generando los elementos de un iterable.
+
+        Sirve para las etapas que se ejecutan en flujo, intercaladas con otras: solo
+        se cuenta el tiempo dentro del generador, y el de CPU es el del hilo que lo
+        consume.
+        """
+        pared = cpu = 0.0
+        iterador = iter(iterable)
+        while True:
+            terminado = False
+            with self.medir(nombre) as marco:
+                try:
+                    elemento = next(iterador)
+                except StopIteration:
+                    terminado = True
+            pared += marco["pared"]
+            cpu += marco["cpu"]
+            if terminado:
+                break
+            yield elemento
+
+        self.registrar({
+            "etapa": nombre,
+            **datos,
+            "pared_s": pared,
+            "cpu_s": cpu,
+            "bytes_leidos": 0,
+            "bytes_escritos": 0,
+            "memoria_pico_mb": memoria_pico_mb(),
+        })
+
+    @contextmanager
+    def etapa_en_hilos(self, nombre, **datos):
+        """
+        Mide como una etapa el trabajo que se reparte entre varios hilos.
+
+        Genera una función `medir` y cada hilo envuelve su parte en `with medir():`.
+        El tiempo real registrado es la suma del de todos los hilos, así que puede
+        superar al transcurrido.
+        """
+        totales = {"pared": 0.0, "cpu": 0.0}
+
+        @contextmanager
+        def medir():
+            with self.medir(nombre) as marco:
+                yield
+            with self.cerrojo:
+                totales["pared"] += marco["pared"]
+                totales["cpu"] += marco["cpu"]
+
+        try:
+            yield medir
+        finally:
+            self.registrar({
+                "etapa": nombre,
+                **datos,
+                "pared_s": totales["pared"],
+                "cpu_s": totales["cpu"],
+                "bytes_leidos": 0,
+                "bytes_escritos": 0,
+                "memoria_pico_mb": memoria_pico_mb(),
+            })
+
+    def registrar(self, registro):
+        """Guarda un registro de etapa, lo emite si el formato es JSON y avisa a los oyentes."""
+        self.registros.append(registro)
+        if self.formato == "json":
+            linea = json.dumps(registro, ensure_ascii=False)
+            if self.salida:
+                with open(self.salida, "a", encoding="utf-8") as archivo:
+                    archivo.write(linea + "\n")
+            else:
+                print(linea)
+        for oyente in self.oyentes:
+            oyente(registro)
+
+    def agregar(self):
+        """Suma los registros por etapa, en el orden en que aparecieron."""
+        totales = {}
+        for registro in self.registros:
+            total = totales.setdefault(registro["etapa"], {
+                "veces": 0, "pared_s": 0.0, "cpu_s": 0.0, "bytes_leidos": 0, "bytes_escritos": 0,
+                "memoria_pico_mb": 0.0,
+            })
+            total["veces"] += 1
+            for campo in ("pared_s", "cpu_s", "bytes_leidos", "bytes_escritos"):
+                total[campo] += registro[campo]
+            total["memoria_pico_mb"] = max(total["memoria_pico_mb"], registro["memoria_pico_mb"])
+        return totales
+
+    def mostrar_resumen(self):
+        """Muestra la tabla resumen (formato 'tabla') y guarda el cProfile de la etapa más lenta."""
+        totales = self.agregar()
+        if self.formato == "tabla" and totales:
+            print(f"{'Etapa':<14}{'Veces':>7}{'Real (s)':>11}{'CPU (s)':>11}"
+                  f"{'Leído (MB)':>13}{'Escrito (MB)':>14}{'Pico (MB)':>11}")
+            for nombre, total in totales.items():
+                print(f"{nombre:<14}{total['veces']:>7}{total['pared_s']:>11.3f}{total['cpu_s']:>11.3f}"
+                      f"{total['bytes_leidos'] / 1e6:>13.1f}{total['bytes_escritos'] / 1e6:>14.1f}"
+                      f"{total['memoria_pico_mb']:>11.1f}")
+
+        if self.ruta_cprofile and self.perfiles:
+            mas_lenta = max(self.perfiles, key=lambda nombre: totales.get(nombre, {}).get("pared_s", 0.0))
+            estadisticas = pstats.Stats(*self.perfiles[mas_lenta])
+            estadisticas.dump_stats(self.ruta_cprofile)
+            print(f"Perfil de cProfile de la etapa '{mas_lenta}' guardado en: {self.ruta_cprofile}")
+            estadisticas.sort_stats("cumulative").print_stats(15)
+
+# Perfilador activo del proceso; sin él, las etapas no miden nada
+perfilador_activo = None
+
+def activar(perfilador):
+    """Activa un perfilador para todas las etapas instrumentadas. Devuelve el anterior."""
+    global perfilador_activo
+    anterior = perfilador_activo
+    perfilador_activo = perfilador
+    return anterior
+
+def etapa(nombre, **datos):
+    """Mide el bloque con el perfilador activo, o no hace nada si no hay ninguno."""
+    if perfilador_activo is None:
+        return nullcontext()
+    return perfilador_activo.etapa(nombre, **datos)
+
+def medir_iterable(nombre, iterable, **datos):
+    """Mide la generación de un iterable con el perfilador activo, o lo devuelve tal cual."""
+    if perfilador_activo is None:
+        return iterable
+    return perfilador_activo.medir_iterable(nombre, iterable, **datos)
+
+def etapa_en_hilos(nombre, **datos):
+    """
+    Mide el trabajo de varios hilos con el perfilador activo (ver
+    `Perfilador.etapa_en_hilos`). Sin perfilador, `medir()` no hace nada.
+    """
+    if perfilador_activo is None:
+        return nullcontext(nullcontext)
+    return perfilador_activo.etapa_en_hilos(nombre, **datos)
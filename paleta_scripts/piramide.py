@@ -0,0 +1,119 @@
+import os
+import math
+from perezoso import importar_perezoso
+
+Image = importar_perezoso("PIL.Image")
+np = importar_perezoso("numpy")
+
+# Filas de origen, aproximadas, de cada banda al reducir con un factor no entero
+ALTO_BANDA_REDUCCION = 1024
+
+def validar_escalas(escalas):
+    """Comprueba que las escalas sirven para una pirámide de reducción. Devuelve un mensaje de error o None."""
+    if escalas and not all(0 < escala <= 1 for escala in escalas):
+        return "Error: Las escalas deben ser mayores que 0 y como mucho 1 (por ejemplo: --escalas 1 0.5 0.25)."
+    return None
+
+def directorio_escala(directorio_salida, escala):
+    """Subdirectorio de salida de una escala, por ejemplo 'salida/0.5x'."""
+    return os.path.join(directorio_salida, f"{escala:g}x")
+
+def tamaño_escalado(tamaño, escala):
+    """Tamaño de la imagen original a la escala indicada, de al menos 1×1."""
+    ancho, alto = tamaño
+    return max(1, round(ancho * escala)), max(1, round(alto * escala))
+
+def bandas_reduccion(alto, nuevo_alto):
+    """
+    Reparte las filas de destino de una reducción en bandas de unas
+    `ALTO_BANDA_REDUCCION` filas de origen.
+
+    Genera (destino_inicio, destino_fin, origen_inicio, origen_fin), con las
+    filas de origen como números reales.
+    """
+    escala_y = alto / nuevo_alto
+    filas_por_banda = max(1, ALTO_BANDA_REDUCCION * nuevo_alto // alto)
+    for destino_inicio in range(0, nuevo_alto, filas_por_banda):
+        destino_fin = min(nuevo_alto, destino_inicio + filas_por_banda)
+        yield destino_inicio, destino_fin, destino_inicio * escala_y, destino_fin * escala_y
+
+def reducir(imagen, tamaño):
+    """
+    Reduce una imagen al tamaño indicado con un filtro de caja.
+
+    PIL premultiplica el alpha al reducir, así que los bordes transparentes no
+    oscurecen los colores. Si el tamaño divide exactamente al de la imagen se
+    usa `reduce`, que es más rápido.
+
+    Si no, la imagen se reduce por bandas (ver `bandas_reduccion`). El filtro
+    de PIL decide qué filas entran en cada ventana con aritmética de coma
+    flotante, y el resultado cambia según dónde empieza la imagen que recibe,
+    así que las bandas son siempre las mismas: una hoja grande (ver
+    `hoja_grande.HojaGrande`), que solo se puede leer por partes, da el mismo
+    resultado que la hoja en memoria, sea cual sea su `alto_banda`.
+    """
+    grande = hasattr(imagen, "bandas")
+    if not grande and imagen.mode not in ("RGB", "RGBA", "L", "LA"):
+        # Las imágenes con paleta solo se pueden reducir por vecino más cercano
+        imagen = imagen.convert("RGBA")
+    ancho, alto = imagen.size
+    nuevo_ancho, nuevo_alto = tamaño
+    factor = None
+    if ancho % nuevo_ancho == 0 and alto % nuevo_alto == 0:
+        factor = (ancho // nuevo_ancho, alto // nuevo_alto)
+        if not grande:
+            return imagen.reduce(factor)
+
+    resultado = Image.new("RGBA" if grande else imagen.mode, tamaño)
+    for destino_inicio, destino_fin, origen_inicio, origen_fin in bandas_reduccion(alto, nuevo_alto):
+        primera, ultima = int(origen_inicio), min(alto, math.ceil(origen_fin))
+        if grande:
+            banda = Image.fromarray(np.ascontiguousarray(imagen.datos[primera:ultima]), "RGBA")
+        else:
+            banda = imagen.crop((0, primera, ancho, ultima))
+        if factor:
+            # Con un factor entero cada banda empieza en un bloque completo, y
+            # se reduce igual que la imagen entera
+            parte = banda.reduce(factor)
+        else:
+            parte = banda.resize((nuevo_ancho, destino_fin - destino_inicio), Image.Resampling.BOX,
+                                 box=(0, origen_inicio - primera, ancho, origen_fin - primera))
+        resultado.paste(parte, (0, destino_inicio))
+    if grande and imagen.mode != "RGBA":
+        # Las hojas grandes RGB o L se reducen desde la caché RGBA, opaca, y
+        # vuelven a su modo sin cambiar ningún valor
+        resultado = resultado.convert(imagen.mode)
+    return resultado
+
+def construir_piramide(imagen, escalas):
+    """
+    Genera pares (escala, imagen) de mayor a menor escala.
+
+    La escala 1 es la propia imagen y cada nivel se obtiene reduciendo el
+    anterior, no el original, así que cada reducción trabaja con menos píxeles.
+    Solo se conservan en memoria el nivel actual y el anterior.
+    """
+    anterior = imagen
+    for escala in sorted(set(escalas), reverse=True):
+        if escala == 1:
+            yield escala, imagen
+            continue
+        nivel = reducir(anterior, tamaño_escalado(imagen.size, escala))
+        yield escala, nivel
+        anterior = nivel
+
+def escalar_cajas(cajas, tamaño_original, tamaño_nivel):
+    """
+    Lleva las cajas (x1, y1, x2, y2) de la imagen original a un nivel de la pirámide.
+
+    Los bordes se redondean por separado, de modo que las celdas contiguas siguen
+    siéndolo, y ninguna caja queda por debajo de 1×1.
+    """
+    factor_x = tamaño_nivel[0] / tamaño_original[0]
+    factor_y = tamaño_nivel[1] / tamaño_original[1]
+    escaladas = []
+    for x1, y1, x2, y2 in cajas:
+        nuevo_x1, nuevo_y1 = round(x1 * factor_x), round(y1 * factor_y)
+        escaladas.append((nuevo_x1, nuevo_y1,
+                          max(round(x2 * factor_x), nuevo_x1 + 1), max(round(y2 * factor_y), nuevo_y1 + 1)))
+    return escaladas
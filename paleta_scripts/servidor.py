@@ -0,0 +1,182 @@
+import os
+import sys
+import json
+import socket
+import stat
+import argparse
+import tempfile
+import importlib
+import threading
+import traceback
+import socketserver
+from contextlib import redirect_stdout, redirect_stderr
+
+# Herramientas que el servidor puede ejecutar; cada una es un módulo con main(argumentos)
+HERRAMIENTAS = ("dividir", "aplicar_fondo", "dividir_con_fondo")
+
+PUERTO_PREDETERMINADO = 8765
+
+def direccion_predeterminada():
+    """Socket Unix en el directorio temporal, o un puerto local donde no hay sockets Unix (Windows)."""
+    if hasattr(socket, "AF_UNIX"):
+        return os.path.join(tempfile.gettempdir(), "paleta_scripts.sock")
+    return str(PUERTO_PREDETERMINADO)
+
+def es_puerto(direccion):
+    """Una dirección formada solo por dígitos es un puerto de 127.0.0.1; cualquier otra, la ruta de un socket Unix."""
+    return direccion.isdigit()
+
+def conectar(direccion):
+    """Abre una conexión con el servidor. Lanza OSError si no hay ninguno escuchando."""
+    if es_puerto(direccion):
+        return socket.create_connection(("127.0.0.1", int(direccion)))
+    conexion = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conexion.connect(direccion)
+    except OSError:
+        conexion.close()
+        raise
+    return conexion
+
+def enviar(archivo, mensaje):
+    """Envía un mensaje como una línea JSON."""
+    archivo.write(json.dumps(mensaje, ensure_ascii=False).encode("utf-8") + b"\n")
+    archivo.flush()
+
+class SalidaRemota:
+    """
+    Sustituye a stdout o stderr durante un trabajo y reenvía al cliente todo lo
+    que se escribe. Los hilos de escritura también imprimen, así que cada
+    mensaje se envía entero bajo un cerrojo.
+    """
+
+    def __init__(self, archivo, flujo, cerrojo):
+        self.archivo = archivo
+        self.flujo = flujo
+        self.cerrojo = cerrojo
+
+    def write(self, texto):
+        if texto:
+            with self.cerrojo:
+                enviar(self.archivo, {"flujo": self.flujo, "texto": texto})
+        return len(texto)
+
+    def flush(self):
+        pass
+
+def ejecutar_trabajo(herramienta, argumentos, directorio):
+    """
+    Ejecuta una herramienta como si se hubiera llamado desde la línea de
+    comandos en `directorio`. Devuelve el código de salida.
+    """
+    if herramienta not in HERRAMIENTAS:
+        print(f"Herramienta desconocida: {herramienta}. Disponibles: {', '.join(HERRAMIENTAS)}", file=sys.stderr)
+        return 2
+
+    directorio_anterior = os.getcwd()
+    argv_anterior = sys.argv
+    try:
+        os.chdir(directorio or directorio_anterior)
+        # argparse toma el nombre del programa de sys.argv[0] para --help y los errores
+        sys.argv = [f"{herramienta}.py", *argumentos]
+        importlib.import_module(herramienta).main(argumentos)
+        return 0
+    except SystemExit as e:
+        # argparse termina así con --help y con argumentos no válidos
+        return e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except Exception:
+        traceback.print_exc()
+        return 1
+    finally:
+        sys.argv = argv_anterior
+        os.chdir(directorio_anterior)
+
+class ManejadorTrabajos(socketserver.StreamRequestHandler):
+    """Atiende una conexión: lee un trabajo, reenvía su salida y termina con el código de salida."""
+
+    def handle(self):
+        try:
+            peticion = json.loads(self.rfile.readline())
+        except ValueError:
+            return
+
+        if peticion.get("orden") == "detener":
+            self.server.detener = True
+            enviar(self.wfile, {"codigo": 0})
+            return
+
+        cerrojo = threading.Lock()
+        salida = SalidaRemota(self.wfile, "stdout", cerrojo)
+        errores = SalidaRemota(self.wfile, "stderr", cerrojo)
+        try:
+            with redirect_stdout(salida), redirect_stderr(errores):
+                codigo = ejecutar_trabajo(peticion.get("herramienta"), peticion.get("argumentos", []),
+                                          peticion.get("directorio"))
+            enviar(self.wfile, {"codigo": codigo})
+        except (BrokenPipeError, ConnectionResetError):
+            # El cliente se ha ido a mitad del trabajo
+            pass
+
+def crear_servidor(direccion):
+    """
+    Crea el servidor en la dirección indicada.
+
+    Los trabajos se atienden de uno en uno: comparten las cachés de fondos y el
+    directorio de trabajo del proceso, y cada uno ya reparte la escritura entre
+    varios hilos o procesos.
+    """
+    if es_puerto(direccion):
+        servidor = socketserver.TCPServer(("127.0.0.1", int(direccion)), ManejadorTrabajos)
+    else:
+        if os.path.exists(direccion):
+            if not stat.S_ISSOCK(os.stat(direccion).st_mode):
+                raise FileExistsError(f"La dirección '{direccion}' ya existe y no es un socket.")
+            # Socket de un servidor anterior que no se cerró bien
+            os.remove(direccion)
+        servidor = socketserver.UnixStreamServer(direccion, ManejadorTrabajos)
+    servidor.detener = False
+    return servidor
+
+def precargar():
+    """Importa de antemano las herramientas, NumPy, PIL y sus formatos, que se importan al usarlos por primera vez."""
+    for herramienta in HERRAMIENTAS:
+        importlib.import_module(herramienta)
+    import numpy
+    import PIL.Image
+    # Usar un atributo completa la importación que perezoso.py había dejado pendiente
+    numpy.zeros(1)
+    PIL.Image.init()
+
+def crear_parser():
+    """Crea el parser de argumentos de la línea de comandos."""
+    parser = argparse.ArgumentParser(
+        description="Mantiene las herramientas cargadas en un proceso y atiende los trabajos de cliente.py, "
+                    "sin pagar el arranque de Python, NumPy y PIL ni volver a decodificar los fondos en cada llamada.")
+    parser.add_argument("--direccion", default=direccion_predeterminada(),
+                        help="Ruta del socket Unix, o un número de puerto para escuchar en 127.0.0.1 "
+                             f"(predeterminado: '{direccion_predeterminada()}')")
+    return parser
+
+def main():
+    args = crear_parser().parse_args()
+    precargar()
+
+    try:
+        servidor = crear_servidor(args.direccion)
+    except OSError as e:
+        print(f"Error: No se pudo escuchar en {args.direccion}: {e}")
+        return
+    print(f"Servidor escuchando en {args.direccion}. Detener con Ctrl+C o 'python cliente.py --detener'.")
+    try:
+        while not servidor.detener:
+            servidor.handle_request()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+        if not es_puerto(args.direccion) and os.path.exists(args.direccion):
+            os.remove(args.direccion)
+    print("Servidor detenido.")
+
+if __name__ == "__main__":
+    main()
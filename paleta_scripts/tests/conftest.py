@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Los scripts se importan por su nombre, como cuando se ejecutan desde su directorio
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
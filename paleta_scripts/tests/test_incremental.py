@@ -0,0 +1,111 @@
+import os
+from PIL import Image
+from incremental import NOMBRE_MANIFIESTO, Manifiesto, calcular_clave
+
+def sprite(color, tamaño=(4, 4)):
+    return Image.new("RGBA", tamaño, color)
+
+def ejecutar(directorio, ruta_hoja, sprites, clave="clave", codificacion=None):
+    """
+    Simula una ejecución incremental: pasa los sprites {nombre: imagen} por el
+    filtro del manifiesto, guarda los que deja pasar y cierra la hoja.
+
+    Devuelve (nombres escritos, sin cambios, eliminados).
+    """
+    manifiesto = Manifiesto(str(directorio))
+    manifiesto.iniciar_hoja(ruta_hoja, codificacion)
+    elementos = [(os.path.join(directorio, nombre), imagen) for nombre, imagen in sprites.items()]
+    escritos = []
+    for ruta, imagen in manifiesto.filtro(ruta_hoja)(elementos):
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        imagen.save(ruta)
+        escritos.append(os.path.relpath(ruta, directorio))
+    sin_cambios, eliminados = manifiesto.cerrar_hoja(ruta_hoja, clave)
+    manifiesto.guardar()
+    return escritos, sin_cambios, eliminados
+
+def test_hoja_sin_cambios_se_omite(tmp_path):
+    ruta_hoja = tmp_path / "hoja.png"
+    sprite((255, 0, 0, 255), (8, 4)).save(ruta_hoja)
+    salida = tmp_path / "salida"
+    clave = calcular_clave([ruta_hoja], {"modo": "auto"})
+    ejecutar(salida, ruta_hoja, {"sprite_1.png": sprite((255, 0, 0, 255))}, clave)
+
+    assert Manifiesto(str(salida)).sin_cambios(ruta_hoja, clave) is not None
+    # Otros parámetros o una hoja distinta cambian la clave
+    assert Manifiesto(str(salida)).sin_cambios(ruta_hoja, calcular_clave([ruta_hoja], {"modo": "fijo"})) is None
+    sprite((0, 255, 0, 255), (8, 4)).save(ruta_hoja)
+    assert Manifiesto(str(salida)).sin_cambios(ruta_hoja, calcular_clave([ruta_hoja], {"modo": "auto"})) is None
+
+def test_hoja_sin_cambios_se_reprocesa_si_falta_una_salida(tmp_path):
+    ruta_hoja = str(tmp_path / "hoja.png")
+    ejecutar(tmp_path, ruta_hoja, {"sprite_1.png": sprite((1, 2, 3, 255)), "sprite_2.png": sprite((4, 5, 6, 255))})
+    os.remove(tmp_path / "sprite_2.png")
+    assert Manifiesto(str(tmp_path)).sin_cambios(ruta_hoja, "clave") is None
+
+def test_solo_se_reescriben_los_sprites_distintos(tmp_path):
+    ruta_hoja = str(tmp_path / "hoja.png")
+    ejecutar(tmp_path, ruta_hoja, {"sprite_1.png": sprite((1, 2, 3, 255)), "sprite_2.png": sprite((4, 5, 6, 255))})
+    escritos, sin_cambios, eliminados = ejecutar(
+        tmp_path, ruta_hoja, {"sprite_1.png": sprite((1, 2, 3, 255)), "sprite_2.png": sprite((9, 9, 9, 255))},
+        clave="otra")
+    assert escritos == ["sprite_2.png"]
+    assert (sin_cambios, eliminados) == (1, 0)
+
+def test_se_eliminan_las_salidas_antiguas(tmp_path):
+    ruta_hoja = str(tmp_path / "hoja.png")
+    sprites = {f"sprite_{i}.png": sprite((i, i, i, 255)) for i in range(1, 4)}
+    sprites[os.path.join("0.5x", "sprite_1.png")] = sprite((1, 1, 1, 255), (2, 2))
+    ejecutar(tmp_path, ruta_hoja, sprites)
+    # Un archivo que el manifiesto no generó nunca se toca
+    (tmp_path / "notas.txt").write_text("hola")
+
+    escritos, sin_cambios, eliminados = ejecutar(
+        tmp_path, ruta_hoja, {"sprite_1.png": sprite((1, 1, 1, 255))}, clave="otra")
+    assert escritos == []
+    assert (sin_cambios, eliminados) == (1, 3)
+    assert sorted(os.listdir(tmp_path)) == sorted(["0.5x", NOMBRE_MANIFIESTO, "notas.txt", "sprite_1.png"])
+    assert os.listdir(tmp_path / "0.5x") == []
+
+def test_no_se_eliminan_archivos_fuera_de_la_salida(tmp_path):
+    salida = tmp_path / "salida"
+    ruta_hoja = str(tmp_path / "hoja.png")
+    ejecutar(salida, ruta_hoja, {"sprite_1.png": sprite((1, 1, 1, 255))})
+    victima = tmp_path / "victima.txt"
+    victima.write_text("hola")
+    absoluta = tmp_path / "absoluta.txt"
+    absoluta.write_text("hola")
+
+    # Un manifiesto manipulado que apunta fuera del directorio de salida
+    manifiesto = Manifiesto(str(salida))
+    salidas = manifiesto.hojas[Manifiesto.identificador(ruta_hoja)]["salidas"]
+    salidas.update({os.path.join("..", "victima.txt"): None, str(absoluta): None,
+                    os.path.join("sub", "..", "..", "victima.txt"): None})
+    manifiesto.guardar()
+
+    _, _, eliminados = ejecutar(salida, ruta_hoja, {"sprite_1.png": sprite((1, 1, 1, 255))}, clave="otra")
+    assert eliminados == 0
+    assert victima.exists() and absoluta.exists()
+
+def test_las_salidas_de_otra_hoja_no_se_eliminan(tmp_path):
+    ejecutar(tmp_path, str(tmp_path / "a.png"), {"a_1.png": sprite((1, 1, 1, 255))})
+    _, _, eliminados = ejecutar(tmp_path, str(tmp_path / "b.png"), {"b_1.png": sprite((2, 2, 2, 255))})
+    assert eliminados == 0
+    assert os.path.exists(tmp_path / "a_1.png")
+
+def test_otra_codificacion_reescribe_todo(tmp_path):
+    ruta_hoja = str(tmp_path / "hoja.png")
+    sprites = {"sprite_1.png": sprite((1, 2, 3, 255)), "sprite_2.png": sprite((4, 5, 6, 255))}
+    ejecutar(tmp_path, ruta_hoja, sprites, codificacion=[6, False])
+
+    escritos, sin_cambios, eliminados = ejecutar(tmp_path, ruta_hoja, sprites, clave="otra", codificacion=[1, False])
+    assert sorted(escritos) == ["sprite_1.png", "sprite_2.png"]
+    assert (sin_cambios, eliminados) == (0, 0)
+
+    # Con la misma codificación vuelven a omitirse
+    escritos, sin_cambios, _ = ejecutar(tmp_path, ruta_hoja, sprites, clave="otra mas", codificacion=[1, False])
+    assert (escritos, sin_cambios) == ([], 2)
+
+def test_manifiesto_dañado_equivale_a_ninguno(tmp_path):
+    (tmp_path / NOMBRE_MANIFIESTO).write_text("{no es json")
+    assert Manifiesto(str(tmp_path)).sin_cambios(str(tmp_path / "hoja.png"), "clave") is None